@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Mémoire persistante des correspondances de noms patients (SQLite, sans
+dépendance Streamlit) : clé canonique cible -> clé canonique retenue dans
+l'index d'une source ("Desmos", "Cosmident", "Résultat").
+
+    store = AliasStore("aliases.sqlite")
+    df_final, _ = fuse(..., aliases=store)
+    store.flush()            # écriture groupée des nouveaux matchs
+
+best_match_key consulte l'alias (dict en mémoire, O(1)) avant tout score
+fuzzy : d'un mois sur l'autre, les mêmes patients ne sont plus rescorés.
+Un alias confirmé à la main (confirm) est pris tel quel et n'est jamais
+écrasé par un match automatique ; un alias appris automatiquement n'est
+retenu que s'il passe encore le seuil et la tolérance du run (un seul score,
+pas de classement des candidats).
+
+    python aliases.py aliases.sqlite list [--source Desmos]
+    python aliases.py aliases.sqlite confirm Desmos "DUPONT Jean" "DUPOND Jean"
+    python aliases.py aliases.sqlite forget Desmos "DUPONT Jean"
+"""
+import argparse
+import sqlite3
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from matching import canonical_tokens
+
+ALIAS_DB = "aliases.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS aliases (
+    source     TEXT NOT NULL,
+    target_key TEXT NOT NULL,
+    alias_key  TEXT NOT NULL,
+    confirmed  INTEGER NOT NULL DEFAULT 0,
+    updated    TEXT NOT NULL,
+    PRIMARY KEY (source, target_key)
+) WITHOUT ROWID
+"""
+
+# Un match automatique ne remplace pas une confirmation manuelle
+_UPSERT = """
+INSERT INTO aliases (source, target_key, alias_key, confirmed, updated) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (source, target_key) DO UPDATE SET
+    alias_key = excluded.alias_key, confirmed = excluded.confirmed, updated = excluded.updated
+WHERE excluded.confirmed >= aliases.confirmed
+"""
+
+
+def name_key(name: str) -> str:
+    return " ".join(canonical_tokens(str(name)))
+
+
+class AliasStore:
+    def __init__(self, path=ALIAS_DB):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._mappings = {}
+        self._pending = {}
+
+    def mapping(self, source: str) -> dict:
+        """{clé cible: (clé alias, confirmé)} de la source, chargé une fois puis tenu à jour en mémoire."""
+        if source not in self._mappings:
+            rows = self._conn.execute("SELECT target_key, alias_key, confirmed FROM aliases WHERE source = ?",
+                                      (source,))
+            self._mappings[source] = {t: (a, bool(c)) for t, a, c in rows}
+        return self._mappings[source]
+
+    def record(self, source: str, pairs, confirmed: bool = False):
+        """Ajoute des (clé cible, clé alias) en attente ; écrits au prochain flush()."""
+        mapping = self.mapping(source)
+        for target_key, alias_key in pairs:
+            prev = mapping.get(target_key)
+            if prev is not None and prev[1] and not confirmed:
+                continue
+            mapping[target_key] = (alias_key, bool(confirmed))
+            self._pending[(source, target_key)] = (alias_key, int(confirmed))
+
+    def confirm(self, source: str, target_name: str, alias_name: str):
+        """Correspondance validée à la main (noms bruts, canonisés ici), écrite immédiatement."""
+        self.record(source, [(name_key(target_name), name_key(alias_name))], confirmed=True)
+        self.flush()
+
+    def forget(self, source: str, target_name: str) -> bool:
+        target_key = name_key(target_name)
+        self.mapping(source).pop(target_key, None)
+        self._pending.pop((source, target_key), None)
+        cur = self._conn.execute("DELETE FROM aliases WHERE source = ? AND target_key = ?", (source, target_key))
+        self._conn.commit()
+        return cur.rowcount > 0
+
+    def flush(self) -> int:
+        """Écrit les alias en attente en une transaction ; renvoie leur nombre."""
+        if not self._pending:
+            return 0
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [(src, t, a, c, now) for (src, t), (a, c) in self._pending.items()]
+        with self._conn:
+            self._conn.executemany(_UPSERT, rows)
+        self._pending.clear()
+        # relecture : une confirmation existante a pu l'emporter sur un match automatique
+        self._mappings.clear()
+        return len(rows)
+
+    def entries(self, source: str | None = None) -> list:
+        sql = "SELECT source, target_key, alias_key, confirmed, updated FROM aliases"
+        if source is None:
+            return self._conn.execute(sql + " ORDER BY source, target_key").fetchall()
+        return self._conn.execute(sql + " WHERE source = ? ORDER BY target_key", (source,)).fetchall()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Alias patients mémorisés (consultation / confirmation).")
+    parser.add_argument("db", type=Path)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_list = sub.add_parser("list")
+    p_list.add_argument("--source")
+    p_conf = sub.add_parser("confirm")
+    p_conf.add_argument("source")
+    p_conf.add_argument("target")
+    p_conf.add_argument("alias")
+    p_forget = sub.add_parser("forget")
+    p_forget.add_argument("source")
+    p_forget.add_argument("target")
+    args = parser.parse_args(argv)
+
+    with AliasStore(args.db) as store:
+        if args.cmd == "list":
+            for source, target_key, alias_key, confirmed, updated in store.entries(args.source):
+                mark = "✔" if confirmed else " "
+                print(f"{mark} {source:<10} {target_key} -> {alias_key}  ({updated})")
+        elif args.cmd == "confirm":
+            store.confirm(args.source, args.target, args.alias)
+        elif not store.forget(args.source, args.target):
+            print("alias inconnu", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,24 @@
 
 # -*- coding: utf-8 -*-
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import numpy as np
 import pandas as pd
-import re
 import io
-import unicodedata
+import hashlib
+import math
+from functools import partial
 from pathlib import Path
-import fitz  # PyMuPDF
+
+from aliases import ALIAS_DB, AliasStore
+from extraction import (
+    DESMOS_COLUMNS, DESMOS_LAYOUTS, OCR_AVAILABLE, PARSER_VERSION, DesmosLayouts, collect_billing_acts, display_frame,
+    extract_billing_acts, extract_data_from_cosmident, iter_billing_acts, iter_excel_rows, read_desmos_excel,
+)
+from ingestion import Ingestion, count_rows
+from matching import COUNTED_FUNCTIONS, cache_stats, make_index
+from pipeline import fuse, page_styles, read_stage, row_classes, to_csv_bytes, to_parquet_bytes
+from profiling import Profiler
 
 # ==================== CONFIG & LOGO ====================
 st.set_page_config(page_title="Gestion + Comparaison Prothèses", page_icon="🦷", layout="wide")
@@ -34,271 +46,144 @@ with st.sidebar:
     FUZZY_REL_ERR = st.slider("Tolérance aux fautes (édition, %)", 5, 40, 20) / 100.0  # 0.20 par défaut
     SCORE_THRESHOLD = st.slider("Seuil de score global (0.30–0.80)", 0.30, 0.80, 0.50)
     st.caption("Plus la tolérance et le score seuil sont bas, plus le matching est permissif.")
+    PRICE_TOLERANCE_EUR = st.number_input(
+        "Écart de prix toléré (€)", min_value=0.0, max_value=100.0, value=0.0, step=0.5,
+        help="Tarif facturé vs prix Desmos / Cosmident apparié : au-delà, « écart de prix »."
+    )
     ORPHANS_ONLY_ABSENT_IN_RESULT = st.checkbox(
         "🟧 Orphelins Cosmident = Absents dans Résultat (peu importe Desmos)",
         value=False
     )
+    STREAM_BILLING = st.checkbox(
+        "📄 Lecture en flux de l’Excel de facturation (gros fichiers)",
+        value=False,
+        help="Lit les lignes une à une sans charger toute la feuille : mémoire bornée par le résultat. "
+             ".xlsx seulement : un .xls est toujours chargé en entier (limite de xlrd)."
+    )
+    OCR_SCANS = st.checkbox(
+        "🔎 OCR des pages Cosmident scannées",
+        value=False, disabled=not OCR_AVAILABLE,
+        help="Pages sans couche texte passées par Tesseract (texte mis en cache disque)."
+             if OCR_AVAILABLE else "pytesseract ou le binaire tesseract est absent."
+    )
+    OCR_SCANS = OCR_SCANS and OCR_AVAILABLE  # jamais d’OCR sans Tesseract, même si la case a été cochée avant
+    REMEMBER_ALIASES = st.checkbox(
+        f"🧠 Mémoriser les correspondances ({ALIAS_DB})",
+        value=False,
+        help="Réutilise les matchs des runs précédents avant tout calcul fuzzy, et enregistre les nouveaux."
+    )
+    REMEMBER_DESMOS_LAYOUTS = st.checkbox(
+        f"🗂️ Mémoriser les colonnes Desmos ({DESMOS_LAYOUTS})",
+        value=False,
+        help="Colonnes Patient/Acte/Prix retenues par disposition d’en-têtes : détection sautée ensuite."
+    )
+    cache_box = st.empty()  # compteurs des caches, remplis après le matching
+    DIAGNOSTICS = st.checkbox(
+        "🩺 Diagnostics (temps par étape, compteurs d’appels)",
+        value=False,
+        help="Chronomètre chaque étape et compte les appels de matching ; export JSON pour les tickets."
+    )
+    diag_box = st.empty()
+
+prof = Profiler(count_calls=DIAGNOSTICS)
+INGEST_STAGE = "Ingestion (3 fichiers en parallèle)"  # englobe les étapes de lecture par fichier
+
+def show_diagnostics():
+    if not DIAGNOSTICS:
+        return
+    with diag_box.container():
+        with st.expander("🩺 Diagnostics", expanded=True):
+            if prof.stages:
+                st.dataframe(pd.DataFrame(prof.stages), use_container_width=True, hide_index=True)
+            st.caption(f"Total : {prof.total_seconds():.2f} s")
+            for name in COUNTED_FUNCTIONS:
+                st.caption(f"{name} : {prof.calls[name]} appels")
+            st.download_button(
+                label="⬇️ Exporter (JSON)",
+                data=prof.to_json(),
+                file_name="diagnostics_cds2.json",
+                mime="application/json",
+            )
 
-# ==================== UTILITAIRES NOM (ULTRA-PERMISSIF, corrigés) ====================
-COMMON_WORDS = {
-    "de","du","des","la","le","les","d","l","mr","mme","m","monsieur","madame"
-}
-
-def strip_accents(s: str) -> str:
-    s_norm = unicodedata.normalize("NFD", str(s))
-    s_no = "".join(ch for ch in s_norm if unicodedata.category(ch) != "Mn")
-    s_clean = re.sub(r"[^a-zA-Z\s\-']", " ", s_no)
-    s_clean = re.sub(r"\s+", " ", s_clean).strip().lower()
-    return s_clean
-
-def canonical_tokens(name: str) -> list:
-    raw = strip_accents(name)
-    toks = []
-    for t in re.split(r"[ \-]+", raw):
-        t = t.strip()
-        if not t or len(t) < 2:
-            continue
-        if t in COMMON_WORDS:
-            continue
-        toks.append(t)
-    return sorted(toks)  # tri pour ignorer inversion nom/prénom
-
-def levenshtein(a: str, b: str) -> int:
-    """Distance d’édition (programmation dynamique, une ligne mémoire)."""
-    if a == b:
-        return 0
-    n, m = len(a), len(b)
-    if n == 0:
-        return m
-    if m == 0:
-        return n
-    prev_row = list(range(m + 1))
-    for i, ca in enumerate(a, 1):
-        curr = [i]
-        for j, cb in enumerate(b, 1):
-            insert_cost = curr[j - 1] + 1
-            delete_cost = prev_row[j] + 1
-            subst_cost  = prev_row[j - 1] + (0 if ca == cb else 1)
-            curr.append(min(insert_cost, delete_cost, subst_cost))
-        prev_row = curr
-    return prev_row[-1]
-
-def fuzzy_equal(a: str, b: str) -> bool:
-    """
-    Tolère petites fautes: distance d'édition <= FUZZY_REL_ERR * longueur max.
-    """
-    if a == b:
-        return True
-    if not a or not b:
-        return False
-    L = max(len(a), len(b))
-    return (levenshtein(a, b) / L) <= FUZZY_REL_ERR
-
-def match_tokens_count(ta: list, tb: list) -> int:
-    """Greedy matching de tokens entre deux listes, avec fuzzy_equal, sans doublons côté B."""
-    used_b = set()
-    k = 0
-    for a in ta:
-        for j, b in enumerate(tb):
-            if j in used_b:
-                continue
-            if a == b or fuzzy_equal(a, b):
-                used_b.add(j)
-                k += 1
-                break
-    return k
-
-def core_tokens(tokens: list, n: int = 2) -> list:
-    return sorted(tokens, key=len, reverse=True)[:n]
-
-def names_match_permissive(name_a: str, name_b: str) -> tuple[bool, float]:
-    """
-    (match_bool, score) — règles permissives :
-    - couverture k / min(lenA, lenB) >= 0.66
-    - OU k >= 2
-    - OU les 2 tokens cœur d’un nom sont présents dans l’autre (exact ou fuzzy)
-    Score = 0.6 * couverture + 0.4 * jaccard + 0.15 * core_bonus
-    """
-    ta = canonical_tokens(name_a)
-    tb = canonical_tokens(name_b)
-    if not ta or not tb:
-        return (False, 0.0)
-
-    if set(ta) == set(tb):
-        return (True, 1.0)
-
-    k = match_tokens_count(ta, tb)
-    minlen = min(len(ta), len(tb)) or 1
-    union = len(set(ta) | set(tb)) or 1
-    coverage = k / minlen
-    jacc = k / union
-
-    ca = core_tokens(ta, 2)
-    cb = core_tokens(tb, 2)
-
-    def core_hit(cside, other):
-        hits = 0
-        for c in cside:
-            if any(c == o or fuzzy_equal(c, o) for o in other):
-                hits += 1
-        return hits >= 2
-
-    core_bonus = 1.0 if (core_hit(ca, tb) or core_hit(cb, ta)) else 0.0
-    score = 0.6 * coverage + 0.4 * jacc + 0.15 * core_bonus
-    match = (coverage >= 0.66) or (k >= 2) or (core_bonus > 0.0)
-
-    return (match, score)
-
-def make_index(df: pd.DataFrame, col_name: str) -> dict:
-    idx = {}
-    if df is None or df.empty or col_name not in df.columns:
-        return idx
-    for _, r in df.iterrows():
-        key_tokens = canonical_tokens(str(r[col_name]))
-        key = " ".join(key_tokens)
-        if key:
-            idx.setdefault(key, []).append(r)
-    return idx
-
-def best_match_row(target_name: str, index: dict, score_threshold: float | None = None):
-    """
-    Cherche le meilleur candidat par score permissif.
-    Retourne la ligne si score >= score_threshold (par défaut : SCORE_THRESHOLD).
-    """
-    if score_threshold is None:
-        score_threshold = SCORE_THRESHOLD
-    target_key = " ".join(canonical_tokens(target_name))
-    if not target_key or not index:
-        return None
-
-    # priorité: clé exacte
-    if target_key in index:
-        return index[target_key][0]
-
-    best = None
-    best_score = 0.0
-    for cand_key, rows in index.items():
-        match, score = names_match_permissive(target_key, cand_key)
-        if match and score > best_score:
-            best = rows[0]
-            best_score = score
-
-    return best if best_score >= score_threshold else None
+# ==================== CACHE DES FICHIERS (entre les reruns Streamlit) ====================
+# Chaque widget relance le script : les parsings sont mis en cache sur le hash
+# du contenu uploadé + PARSER_VERSION (les octets eux-mêmes ne sont pas re-hachés
+# par Streamlit : paramètre préfixé « _ »). Seul le matching dépend des curseurs.
+UPLOAD_CACHE_ENTRIES = 8
+
+def file_digest(file) -> str:
+    return hashlib.sha256(file.getvalue()).hexdigest()
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def parse_billing(digest: str, version: int, is_xlsx: bool, stream: bool, _data: bytes,
+                  _progress=None) -> pd.DataFrame:
+    if stream:
+        acts = iter_billing_acts(iter_excel_rows(io.BytesIO(_data), xlsx=is_xlsx))
+        return collect_billing_acts(count_rows(acts, _progress) if _progress else acts)
+    df_raw = pd.read_excel(io.BytesIO(_data), header=None, engine="openpyxl" if is_xlsx else "xlrd")
+    return extract_billing_acts(df_raw)
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def parse_cosmident(digest: str, version: int, ocr: bool, _data: bytes,
+                    _progress=None) -> tuple[pd.DataFrame, str, list]:
+    """(lignes, aperçu, avertissements) ; les avertissements (pages OCR en échec) restent en cache avec le reste."""
+    warnings = []
+
+    def progress(warning: str | None = None, **counts):
+        if warning is not None:
+            warnings.append(warning)
+        elif _progress is not None:
+            _progress(**counts)
+
+    df, preview = extract_data_from_cosmident(_data, ocr=ocr, progress=progress)
+    return df, preview, warnings
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def parse_desmos(digest: str, version: int, is_xlsx: bool, remember: bool, _data: bytes) -> pd.DataFrame:
+    layouts = desmos_layouts(DESMOS_LAYOUTS) if remember else None
+    return read_desmos_excel(io.BytesIO(_data), xlsx=is_xlsx, layouts=layouts)
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def parse_desmos_columns(digest: str, version: int, is_xlsx: bool, pcol: str, acol: str, prcol: str,
+                         remember: bool, _data: bytes) -> pd.DataFrame:
+    """Colonnes choisies à la main : seules ces trois colonnes sont lues, choix mémorisé si remember."""
+    mapping = dict(zip(DESMOS_COLUMNS, (pcol, acol, prcol)))
+    layouts = desmos_layouts(DESMOS_LAYOUTS) if remember else None
+    return read_desmos_excel(io.BytesIO(_data), xlsx=is_xlsx, layouts=layouts, mapping=mapping)
+
+@st.cache_resource
+def desmos_layouts(path: str) -> DesmosLayouts:
+    """Colonnes Desmos retenues par disposition de fichier (détection sautée aux chargements suivants)."""
+    return DesmosLayouts(path)
+
+@st.cache_data(max_entries=UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def parse_stage(digest: str, version: int, stage: str, _data: bytes) -> pd.DataFrame:
+    """Étape déjà extraite puis exportée en Parquet (aucun re-parsing de la source), refusée si autre étape."""
+    return read_stage(io.BytesIO(_data), stage)
+
+def is_stage(file) -> bool:
+    return file.name.lower().endswith(".parquet")
+
+def download_buttons(df: pd.DataFrame, stem: str, key: str, csv: bool = True, stage: str | None = None):
+    """CSV / Parquet générés seulement au clic (callables), pas à chaque rerun ; stage : étape rechargeable."""
+    if csv:
+        st.download_button(label=f"⬇️ {stem} (CSV)", data=partial(to_csv_bytes, df),
+                           file_name=f"{stem}.csv", mime="text/csv", key=f"{key}_csv")
+    st.download_button(label=f"⬇️ {stem} (Parquet)", data=partial(to_parquet_bytes, df, stage),
+                       file_name=f"{stem}.parquet", mime="application/octet-stream", key=f"{key}_parquet")
+
+@st.cache_resource(max_entries=3 * UPLOAD_CACHE_ENTRIES, show_spinner=False)
+def cached_index(key: str, _df: pd.DataFrame) -> dict:
+    """Index patient d'une source ; ne dépend pas des curseurs (tolérance passée à la requête)."""
+    return make_index(_df, "Patient").prepare()
 
 # ==================== 1) EXTRACTION DES ACTES (Excel de facturation) ====================
 st.subheader("1) Extraction des actes prothétiques (Excel de facturation)")
-uploaded_facturation = st.file_uploader("📥 Charge le fichier Excel (facturation)", type=["xls", "xlsx"])
-
-df_result = pd.DataFrame()
-if uploaded_facturation:
-    try:
-        df_raw = pd.read_excel(
-            uploaded_facturation,
-            header=None,
-            engine="openpyxl" if uploaded_facturation.name.endswith(".xlsx") else "xlrd"
-        )
-    except Exception as e:
-        st.error(f"Erreur de lecture du fichier : {e}")
-        st.stop()
-
-    results = []
-    current_patient = None
-
-    for idx, row in df_raw.iterrows():
-        row = row.astype(str).str.strip()
-        values = [str(v).strip() for v in row.tolist()]
-        row_text = " ".join([v for v in values if v and v not in ["nan", "None", ""]])
-
-        # Réinitialisation sur bloc doublon Factures/Avoirs
-        if re.search(r"Factures et Avoirs CENTRE DE SANTÉ DES LAURIERS", row_text, re.I):
-            current_patient = None
-            continue
-
-        # Détection patient
-        if re.search(r"N°\s*Dossier", row_text, re.I):
-            m = re.search(r"([A-ZÉÈÊËÀÂÄÔÖÙÛÜÇ][A-ZÉÈÊËÀÂÄÔÖÙÛÜÇ'\- ]{4,80})\s+N°\s*Dossier", row_text, re.I)
-            if m:
-                current_patient = m.group(1).strip()
-            continue
-
-        # En-têtes à ignorer
-        header_patterns = [
-            r"^DATE[\s:]", r"^N°\s*FACT", r"^DENT\(S\)", r"^ACTE$", r"^HONO", r"^AMO$",
-            r"^TOTAL DES FACTURES", r"^IMPRIMÉ LE"
-        ]
-        if any(re.search(p, row_text.upper()) for p in header_patterns):
-            continue
-
-        # Recherche du code cible
-        code = None
-        code_idx = -1
-        for i, cell in enumerate(values):
-            cell = cell.strip()
-            if cell and (cell.startswith("HBLD") or cell in ["HBMD351", "HBLD634"]):
-                code = cell
-                code_idx = i
-                break
-
-        if not code:
-            continue
-
-        # Ignorer certains codes
-        if code in ("HBLD490", "HBLD045","HBLD724"):
-            continue
-
-        # Tarif
-        tarif = "?"
-        for offset in [1, 2]:
-            if code_idx + offset < len(values):
-                val = values[code_idx + offset].replace(" ", "")
-                if re.match(r"^\d{1,6}[,.]?\d{0,2}$", val.replace(",", ".")):
-                    tarif = val.replace(".", ",")
-                    break
-
-        # Dent
-        dent = "?"
-        for i in range(code_idx - 1, max(-1, code_idx - 20), -1):
-            m = re.search(r"\b([1-4]?\d)\b", str(values[i]))
-            if m and 1 <= int(m.group(1)) <= 48:
-                dent = m.group(1).zfill(2)
-                break
-
-        # Description acte
-        acte = "?"
-        for i in range(code_idx - 1, max(-1, code_idx - 30), -1):
-            v = str(values[i]).strip()
-            if v and v not in ["nan", "None", ""]:
-                acte = v
-                break
-
-        if not current_patient:
-            continue
-
-        results.append({
-            "Patient": current_patient,
-            "Dent": dent,
-            "Code": code,
-            "Acte": acte,
-            "Tarif": tarif
-        })
-
-    # AFFICHAGE RÉSULTATS
-    if results:
-        df_result = pd.DataFrame(results)[["Patient", "Dent", "Code", "Acte", "Tarif"]]
-        st.success(f"**{len(df_result)} actes prothétiques extraits !**")
-        st.dataframe(df_result, use_container_width=True, hide_index=True)
-
-        csv = df_result.to_csv(index=False, sep=";", encoding="utf-8-sig")
-        st.download_button(
-            label="⬇️ Télécharger le Résultat (CSV)",
-            data=csv,
-            file_name="Protheses_HBLD_HBMD351_HBLD634.csv",
-            mime="text/csv"
-        )
-    else:
-        st.warning("Aucun acte prothétique trouvé.")
-else:
-    st.info("En attente du fichier Excel de facturation…")
+uploaded_facturation = st.file_uploader(
+    "📥 Charge le fichier Excel (facturation)", type=["xls", "xlsx", "parquet"],
+    help="… ou une étape Resultat.parquet déjà exportée (relue sans re-parser l’Excel)."
+)
+res_box = st.container()
 
 st.divider()
 
@@ -307,180 +192,162 @@ st.subheader("2) Charge Cosmident (PDF) et Desmos (Excel) pour la comparaison")
 
 col_b, col_c = st.columns(2)
 with col_b:
-    uploaded_cosmident = st.file_uploader("📥 Cosmident (PDF)", type=["pdf"])
+    uploaded_cosmident = st.file_uploader("📥 Cosmident (PDF)", type=["pdf", "parquet"])
 with col_c:
-    uploaded_desmos = st.file_uploader("📥 Desmos (Excel)", type=["xls", "xlsx"])
-
-# --- Extraction Cosmident (PDF) ---
-def extract_data_from_cosmident(file):
-    file_bytes = file.read()
-    full_text = ""
-    try:
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        for page in doc:
-            page_text = page.get_text("text")
-            stop_pattern = r"(COSMIDENT|IBAN|Siret|BIC|Tél\.|Total \(Euros\)|TOTAL TTC|Règlement|Chèque|NOS COORDONNÉES BANCAIRES)"
-            page_text = re.split(stop_pattern, page_text, flags=re.IGNORECASE)[0]
-            full_text += page_text + "\n"
-    except Exception as e:
-        st.error(f"Erreur ouverture PDF Cosmident : {e}")
-        return pd.DataFrame()
-
-    with st.expander("🧩 Aperçu du texte extrait (Cosmident brut)", expanded=False):
-        st.write(full_text[:2000])
-
-    lines = full_text.split("\n")
-    clean_lines = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        if re.search(r"(teinte|couleur|A[1-3]|B[1-3]|C[1-3]|D[1-3])", line, re.IGNORECASE):
-            continue
-        if re.search(r"(COSMIDENT|IBAN|Siret|BIC|€|TOTAL TTC|CHÈQUE|NOS COORDONNÉES|BANCAIRES)", line, re.IGNORECASE):
-            continue
-        clean_lines.append(line)
-
-    results = []
-    current_patient = None
-    current_description = ""
-    current_numbers = []
-
-    i = 0
-    while i < len(clean_lines):
-        line = clean_lines[i]
-        i += 1
-
-        ref_match = re.search(r"Ref\.?\s*(?:Patient\s*)?:?\s*([\w\s\-'’]+)", line, re.IGNORECASE)
-        if ref_match:
-            if current_patient and current_description and current_numbers:
-                try:
-                    total = float(str(current_numbers[-1]).replace(",", "."))
-                    if total > 0:
-                        results.append({
-                            "Patient": current_patient.strip(),
-                            "Acte Cosmident": current_description.strip(),
-                            "Prix Cosmident": f"{total:.2f}",
-                        })
-                except ValueError:
-                    pass
-            current_patient = ref_match.group(1).strip()
-            current_description = ""
-            current_numbers = []
-            continue
-
-        if current_patient is None:
-            continue
-
-        this_numbers = re.findall(r"\d+[\.,]\d{2}", line)
-        norm_numbers = [n.replace(",", ".") for n in this_numbers]
-        this_text = re.sub(r"\s*\d+[\.,]\d{2}\s*", " ", line).strip()
-
-        if this_text:
-            if current_description and current_numbers:
-                try:
-                    total = float(str(current_numbers[-1]).replace(",", "."))
-                    if total > 0:
-                        results.append({
-                            "Patient": current_patient.strip(),
-                            "Acte Cosmident": current_description.strip(),
-                            "Prix Cosmident": f"{total:.2f}",
-                        })
-                except ValueError:
-                    pass
-                current_description = ""
-                current_numbers = []
-            current_description = (current_description + " " + this_text).strip()
-
-        if norm_numbers:
-            current_numbers.extend(norm_numbers)
-
-    if current_patient and current_description and current_numbers:
-        try:
-            total = float(str(current_numbers[-1]).replace(",", "."))
-            if total > 0:
-                results.append({
-                    "Patient": current_patient.strip(),
-                    "Acte Cosmident": current_description.strip(),
-                    "Prix Cosmident": f"{total:.2f}",
-                })
-        except ValueError:
-            pass
-
-    df = pd.DataFrame(results)
-    if not df.empty:
-        df = df.drop_duplicates(subset=["Patient", "Acte Cosmident", "Prix Cosmident"])
-    return df
-
-# --- Lecture Desmos (Excel) ---
-def read_desmos_excel(file) -> pd.DataFrame:
-    try:
-        df = pd.read_excel(
-            file,
-            header=0,
-            engine="openpyxl" if str(getattr(file, "name", "")).lower().endswith(".xlsx") else "xlrd"
-        )
-    except Exception as e:
-        st.error(f"Erreur de lecture Desmos (Excel) : {e}")
-        return pd.DataFrame()
-
-    df.columns = [str(c).strip() for c in df.columns]
-
-    def pick(keywords):
-        for c in df.columns:
-            lc = c.lower()
-            if any(k in lc for k in keywords):
-                return c
-        return None
-
-    pcol = pick(["patient", "nom", "ref", "name"])
-    acol = pick(["acte", "soin", "libelle", "description"])
-    prcol = pick(["prix", "hono", "montant", "tarif"])
-
-    if pcol and acol and prcol:
-        df = df[[pcol, acol, prcol]].copy()
-        df.columns = ["Patient", "Acte Desmos", "Prix Desmos"]
-        df["Prix Desmos"] = (
-            df["Prix Desmos"].astype(str)
-            .str.replace(",", ".")
-            .str.extract(r"(\d+(?:\.\d{1,2})?)", expand=False)
-        )
-    return df
-
+    uploaded_desmos = st.file_uploader("📥 Desmos (Excel)", type=["xls", "xlsx", "parquet"])
+cos_box = st.container()
+des_box = st.container()
+
+# ==================== INGESTION CONCURRENTE DES TROIS FICHIERS ====================
+# Les trois parseurs tournent en même temps (threads rattachés à la session
+# Streamlit pour les caches) ; chaque source est affichée et indexée dès
+# qu'elle est prête, avec lignes lues / pages en cours pendant la lecture.
+df_result = pd.DataFrame()
 df_cos = pd.DataFrame()
 df_des = pd.DataFrame()
-
+billing_key = cos_key = des_key = ""
+cos_preview = ""
+
+def billing_parser(data: bytes, digest: str, stage_file: bool, is_xlsx: bool):
+    def parse(task):
+        with prof.stage("Facturation (lecture + extraction)", within=INGEST_STAGE) as stage:
+            if stage_file:
+                df = parse_stage(digest, PARSER_VERSION, "facturation", data)
+            else:
+                df = parse_billing(digest, PARSER_VERSION, is_xlsx, STREAM_BILLING, data, _progress=task.update)
+            stage["lignes"] = len(df)
+        return df
+    return parse
+
+def cosmident_parser(data: bytes, digest: str, stage_file: bool):
+    def parse(task):
+        with prof.stage("Cosmident (PDF)", within=INGEST_STAGE) as stage:
+            if stage_file:
+                df = parse_stage(digest, PARSER_VERSION, "cosmident", data)
+                task.extra = "(étape Parquet importée : pas de texte PDF)"
+            else:
+                df, task.extra, task.warnings = parse_cosmident(digest, PARSER_VERSION, OCR_SCANS, data,
+                                                                _progress=task.update)
+            stage["lignes"] = len(df)
+        return df
+    return parse
+
+def desmos_parser(data: bytes, digest: str, stage_file: bool, is_xlsx: bool):
+    def parse(task):
+        with prof.stage("Desmos (Excel)", within=INGEST_STAGE) as stage:
+            if stage_file:
+                df = parse_stage(digest, PARSER_VERSION, "desmos", data)
+            else:
+                df = parse_desmos(digest, PARSER_VERSION, is_xlsx, REMEMBER_DESMOS_LAYOUTS, data)
+            stage["lignes"] = len(df)
+        return df
+    return parse
+
+ingest = Ingestion(initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx()))
+status_boxes = {}
+if uploaded_facturation:
+    digest = file_digest(uploaded_facturation)
+    billing_key = f"{digest}:{PARSER_VERSION}:{int(STREAM_BILLING)}"
+    ingest.submit("facturation", billing_parser(uploaded_facturation.getvalue(), digest,
+                                                is_stage(uploaded_facturation),
+                                                uploaded_facturation.name.endswith(".xlsx")),
+                  index=partial(cached_index, f"res:{billing_key}"))
+    status_boxes["facturation"] = res_box.empty()
+else:
+    res_box.info("En attente du fichier Excel de facturation…")
 if uploaded_cosmident:
-    uploaded_cosmident.seek(0)
-    df_cos = extract_data_from_cosmident(uploaded_cosmident)
-    if df_cos.empty:
-        st.warning("Cosmident : aucune ligne extraite.")
-    else:
-        st.success(f"✔ Cosmident (PDF) extrait — {len(df_cos)} lignes")
-        st.dataframe(df_cos, use_container_width=True, hide_index=True)
-
+    digest = file_digest(uploaded_cosmident)
+    cos_key = f"{digest}:{PARSER_VERSION}:{int(OCR_SCANS)}"
+    ingest.submit("cosmident", cosmident_parser(uploaded_cosmident.getvalue(), digest, is_stage(uploaded_cosmident)),
+                  index=partial(cached_index, f"cos:{cos_key}"))
+    status_boxes["cosmident"] = cos_box.empty()
+desmos_upload = None
 if uploaded_desmos:
-    uploaded_desmos.seek(0)
-    df_des = read_desmos_excel(uploaded_desmos)
-    if df_des.empty:
-        st.warning("Desmos : fichier lu mais colonnes Patient/Acte/Prix non détectées automatiquement.")
-        st.dataframe(df_des, use_container_width=True, hide_index=True)
-        if not df_des.empty:
-            cols = df_des.columns.tolist()
-            col1, col2, col3 = st.columns(3)
-            with col1: pcol = st.selectbox("Colonne Patient (Desmos)", options=cols)
-            with col2: acol = st.selectbox("Colonne Acte (Desmos)", options=cols)
-            with col3: prcol = st.selectbox("Colonne Prix (Desmos)", options=cols)
-            df_des = df_des[[pcol, acol, prcol]].copy()
-            df_des.columns = ["Patient", "Acte Desmos", "Prix Desmos"]
-            df_des["Prix Desmos"] = (
-                df_des["Prix Desmos"].astype(str)
-                .str.replace(",", ".")
-                .str.extract(r"(\d+(?:\.\d{1,2})?)", expand=False)
-            )
-    else:
-        st.success(f"✔ Desmos (Excel) chargé — {len(df_des)} lignes")
-        st.dataframe(df_des, use_container_width=True, hide_index=True)
+    digest = file_digest(uploaded_desmos)
+    des_key = f"{digest}:{PARSER_VERSION}:{int(REMEMBER_DESMOS_LAYOUTS)}"
+    desmos_upload = (digest, uploaded_desmos.name.lower().endswith(".xlsx"), uploaded_desmos.getvalue())
+    ingest.submit("desmos", desmos_parser(desmos_upload[2], digest, is_stage(uploaded_desmos), desmos_upload[1]),
+                  index=partial(cached_index, f"des:{des_key}"))
+    status_boxes["desmos"] = des_box.empty()
+
+INGEST_LABELS = {"facturation": "Facturation", "cosmident": "Cosmident (PDF)", "desmos": "Desmos (Excel)"}
+
+def show_progress(tasks: dict):
+    for name, task in tasks.items():
+        if not task.done:
+            pages = f", page {task.pages}" if task.pages else ""
+            status_boxes[name].caption(f"⏳ {INGEST_LABELS[name]} : {task.state} — {task.rows} lignes{pages} "
+                                       f"({task.elapsed:.1f} s)")
+
+def show_billing(task):
+    global df_result
+    with res_box:
+        if task.error is not None:
+            st.error(f"Erreur de lecture du fichier : {task.error}")
+            return
+        df_result = task.frame
+        if not df_result.empty:
+            st.success(f"**{len(df_result)} actes prothétiques extraits !**")
+            st.dataframe(display_frame(df_result), use_container_width=True, hide_index=True)
+
+            download_buttons(df_result, "Resultat", "resultat", stage="facturation")
+        else:
+            st.warning("Aucun acte prothétique trouvé.")
+
+def show_cosmident(task):
+    global df_cos, cos_preview
+    with cos_box:
+        if task.error is not None:
+            st.error(f"Erreur ouverture PDF Cosmident : {task.error}")
+        else:
+            df_cos, cos_preview = task.frame, task.extra
+            with st.expander("🧩 Aperçu du texte extrait (Cosmident brut)", expanded=False):
+                st.write(cos_preview)
+            for warning in task.warnings:
+                st.warning(f"Cosmident : {warning}")
+        if df_cos.empty:
+            st.warning("Cosmident : aucune ligne extraite.")
+        else:
+            st.success(f"✔ Cosmident (PDF) extrait — {len(df_cos)} lignes")
+            st.dataframe(display_frame(df_cos), use_container_width=True, hide_index=True)
+            download_buttons(df_cos, "Cosmident", "cosmident", csv=False, stage="cosmident")
+
+def show_desmos(task):
+    global df_des, des_key
+    with des_box:
+        if task.error is not None:
+            st.error(f"Erreur de lecture Desmos (Excel) : {task.error}")
+            return
+        df_des = task.frame
+        if list(df_des.columns) != DESMOS_COLUMNS:
+            # échantillon seulement (en-tête + premières lignes) : le choix relit les trois colonnes
+            st.warning("Desmos : fichier lu mais colonnes Patient/Acte/Prix non détectées automatiquement.")
+            st.dataframe(df_des, use_container_width=True, hide_index=True)
+            if not df_des.empty:
+                cols = df_des.columns.tolist()
+                known = (desmos_layouts(DESMOS_LAYOUTS).get(cols) if REMEMBER_DESMOS_LAYOUTS else None) or {}
+                picks = [cols.index(known[role]) if role in known else 0 for role in DESMOS_COLUMNS]
+                col1, col2, col3 = st.columns(3)
+                with col1: pcol = st.selectbox("Colonne Patient (Desmos)", options=cols, index=picks[0])
+                with col2: acol = st.selectbox("Colonne Acte (Desmos)", options=cols, index=picks[1])
+                with col3: prcol = st.selectbox("Colonne Prix (Desmos)", options=cols, index=picks[2])
+                digest, is_xlsx, data = desmos_upload
+                df_des = parse_desmos_columns(digest, PARSER_VERSION, is_xlsx, pcol, acol, prcol,
+                                              REMEMBER_DESMOS_LAYOUTS, data)
+                des_key = f"{des_key}:{pcol}:{acol}:{prcol}"
+        else:
+            st.success(f"✔ Desmos (Excel) chargé — {len(df_des)} lignes")
+            st.dataframe(display_frame(df_des), use_container_width=True, hide_index=True)
+            download_buttons(df_des, "Desmos", "desmos", csv=False, stage="desmos")
+
+SHOW_SOURCE = {"facturation": show_billing, "cosmident": show_cosmident, "desmos": show_desmos}
+with ingest, prof.stage(INGEST_STAGE) as ingest_stage:
+    for task in ingest.as_completed(on_tick=show_progress):
+        status_boxes[task.name].empty()
+        SHOW_SOURCE[task.name](task)
+    ingest_stage["lignes"] = sum(t.rows for t in ingest.tasks.values()) or None
+if "facturation" in ingest.tasks and ingest.tasks["facturation"].error is not None:
+    st.stop()
 
 st.divider()
 
@@ -489,124 +356,66 @@ st.subheader("3) Matching par Patient (Résultat vs Cosmident/Desmos)")
 
 if df_result.empty:
     st.info("⚠️ Le tableau Résultat n’est pas encore disponible. Charge l’Excel de facturation au §1.")
+    show_diagnostics()
     st.stop()
 
-index_res = make_index(df_result, "Patient")
-index_des = make_index(df_des, "Patient") if not df_des.empty else {}
-index_cos = make_index(df_cos, "Patient") if not df_cos.empty else {}
-
-df_out = df_result.copy()
-
-df_out["Match Desmos"] = False
-df_out["Acte Desmos"] = ""
-df_out["Prix Desmos"] = ""
-df_out["Statut Desmos"] = ""  # "match" ou "aucun match Desmos"
-
-df_out["Match Cosmident"] = False
-df_out["Acte Cosmident"] = ""
-df_out["Prix Cosmident"] = ""
-df_out["Statut Cosmident"] = ""  # "match" ou "aucun match Cosmident"
-
-df_out["Statut Global"] = ""  # 🟩 / 🟦 / 🟥
-
-for i, row in df_out.iterrows():
-    pname = str(row["Patient"])
-
-    r_des = best_match_row(pname, index_des, SCORE_THRESHOLD)
-    if r_des is not None:
-        df_out.at[i, "Match Desmos"] = True
-        df_out.at[i, "Acte Desmos"] = str(r_des.get("Acte Desmos", ""))
-        df_out.at[i, "Prix Desmos"] = str(r_des.get("Prix Desmos", ""))
-        df_out.at[i, "Statut Desmos"] = "match"
-    else:
-        df_out.at[i, "Statut Desmos"] = "aucun match Desmos"
-
-    r_cos = best_match_row(pname, index_cos, SCORE_THRESHOLD)
-    if r_cos is not None:
-        df_out.at[i, "Match Cosmident"] = True
-        df_out.at[i, "Acte Cosmident"] = str(r_cos.get("Acte Cosmident", ""))
-        df_out.at[i, "Prix Cosmident"] = str(r_cos.get("Prix Cosmident", ""))
-        df_out.at[i, "Statut Cosmident"] = "match"
-    else:
-        df_out.at[i, "Statut Cosmident"] = "aucun match Cosmident"
-
-    both = df_out.at[i, "Match Desmos"] and df_out.at[i, "Match Cosmident"]
-    only_one = df_out.at[i, "Match Desmos"] ^ df_out.at[i, "Match Cosmident"]
-    if both:
-        df_out.at[i, "Statut Global"] = "🟩 match Desmos + Cosmident"
-    elif only_one:
-        df_out.at[i, "Statut Global"] = "🟦 match d’un seul"
-    else:
-        df_out.at[i, "Statut Global"] = "🟥 aucun match"
-
-# ==================== 3bis) PRÉFIXE : ORPHELINS COSMIDENT (en orange) ====================
-cos_orphans = []
-if not df_cos.empty:
-    for _, r in df_cos.iterrows():
-        pname_cos = str(r["Patient"])
-        m_res = best_match_row(pname_cos, index_res, SCORE_THRESHOLD)
-        if ORPHANS_ONLY_ABSENT_IN_RESULT:
-            is_orphan = (m_res is None)
-        else:
-            m_des = best_match_row(pname_cos, index_des, SCORE_THRESHOLD)
-            is_orphan = (m_res is None and m_des is None)
-        if is_orphan:
-            cos_orphans.append({
-                "Patient": pname_cos,
-                "Dent": "",
-                "Code": "",
-                "Acte": "",
-                "Tarif": "",
-                "Match Desmos": False,
-                "Acte Desmos": "",
-                "Prix Desmos": "",
-                "Match Cosmident": True,
-                "Acte Cosmident": str(r.get("Acte Cosmident", "")),
-                "Prix Cosmident": str(r.get("Prix Cosmident", "")),
-                "Statut Desmos": "aucun match Desmos",
-                "Statut Cosmident": "orphan Cosmident",
-                "Statut Global": "🟧 Cosmident sans correspondance"
-            })
-
-df_final = pd.concat([pd.DataFrame(cos_orphans), df_out], ignore_index=True)
-st.success(f"✅ Matching terminé — {len(df_final)} lignes (dont {len(cos_orphans)} orphelins Cosmident en tête)")
+# index déjà construits par l'ingestion (cache) ; reconstruit seulement après choix manuel des colonnes Desmos
+with prof.stage("make_index", rows=len(df_result) + len(df_des) + len(df_cos)):
+    index_res = cached_index(f"res:{billing_key}", df_result)
+    index_des = cached_index(f"des:{des_key}", df_des) if not df_des.empty else {}
+    index_cos = cached_index(f"cos:{cos_key}", df_cos) if not df_cos.empty else {}
+
+@st.cache_resource
+def alias_store(path: str) -> AliasStore:
+    return AliasStore(path)
+
+aliases = alias_store(ALIAS_DB) if REMEMBER_ALIASES else None
+
+# Matching par patient + orphelins Cosmident en tête (🟧)
+with prof.counting(), prof.stage("Matching", rows=len(df_result) + len(df_cos)):
+    df_final, n_orphans = fuse(
+        df_result, df_cos, index_res, index_des, index_cos, SCORE_THRESHOLD, FUZZY_REL_ERR,
+        only_absent_in_result=ORPHANS_ONLY_ABSENT_IN_RESULT, aliases=aliases,
+        match_workers=1,  # pas de pool de processus par rerun ; pipeline.py garde le pool en lot
+        price_tol=round(PRICE_TOLERANCE_EUR * 100),
+    )
+if aliases is not None:
+    n_new = aliases.flush()
+    if n_new:
+        st.caption(f"🧠 {n_new} nouvelle(s) correspondance(s) mémorisée(s)")
+with cache_box.container():
+    with st.expander("🧮 Caches de matching", expanded=False):
+        for label, c in cache_stats().items():
+            total = c["hits"] + c["misses"]
+            rate = (100.0 * c["hits"] / total) if total else 0.0
+            st.caption(f"{label} : {c['hits']} hits / {c['misses']} misses ({rate:.0f} %) — {c['taille']}/{c['max']}")
+
+st.success(f"✅ Matching terminé — {len(df_final)} lignes (dont {n_orphans} orphelins Cosmident en tête)")
 
 # ==================== 4) MISE EN COULEUR ====================
-def color_row(row):
-    val = str(row["Statut Global"])
-    if val.startswith("🟩"):
-        base = "background-color: #c6f6d5;"  # vert clair
-    elif val.startswith("🟦"):
-        base = "background-color: #cfe8ff;"  # bleu clair
-    elif val.startswith("🟧"):
-        base = "background-color: #ffe5b4;"  # orange pâle
-    else:
-        base = "background-color: #ffd6d6;"  # rouge clair
-
-    styles = [base] * len(row)
-
-    if "aucun match Desmos" in str(row.get("Statut Desmos", "")):
-        try:
-            col_idx = df_final.columns.get_loc("Statut Desmos")
-            styles[col_idx] = "background-color: #fff3cd;"  # jaune pâle
-        except Exception:
-            pass
-
-    stat_cos = str(row.get("Statut Cosmident", ""))
-    if ("aucun match Cosmident" in stat_cos) or ("orphan Cosmident" in stat_cos):
-        try:
-            col_idx = df_final.columns.get_loc("Statut Cosmident")
-            styles[col_idx] = "background-color: #ffe5b4;"  # orange pâle
-        except Exception:
-            pass
-
-    return styles
-
-styled = df_final.style.apply(color_row, axis=1)
+PAGE_SIZES = [50, 100, 200, 500]
+
+def show_page(df: pd.DataFrame, positions, classes, key: str):
+    """Affiche une page des lignes `positions` de df ; seul ce morceau est stylé et envoyé au navigateur."""
+    n = len(positions)
+    c_size, c_page, c_info = st.columns([1, 1, 3])
+    with c_size:
+        size = st.selectbox("Lignes par page", PAGE_SIZES, index=1, key=f"{key}_size")
+    n_pages = max(1, math.ceil(n / size))
+    with c_page:
+        page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, step=1, key=f"{key}_page")
+    with c_info:
+        st.caption(f"{n} lignes — page {page}/{n_pages}")
+    rows = positions[(page - 1) * size: page * size]
+    view = display_frame(df.iloc[rows])
+    st.dataframe(view.style.apply(page_styles, axis=None, classes=classes[rows]),
+                 use_container_width=True, hide_index=True)
 
 st.subheader("4) Tableau comparé et coloré")
 st.caption("🟩 match Desmos + Cosmident | 🟦 match d’un seul | 🟥 aucun match | 🟧 Cosmident sans correspondance (en tête)")
-st.dataframe(styled, use_container_width=True, hide_index=True)
+with prof.stage("Rendu coloré (page)", rows=len(df_final)):
+    final_classes = row_classes(df_final)
+    show_page(df_final, np.arange(len(df_final)), final_classes, "final")
 
 # ==================== Filtres rapides (optionnels) ====================
 st.markdown("**Filtres rapides :**")
@@ -620,26 +429,19 @@ with col_f3:
 with col_f4:
     show_only_orphans = st.checkbox("🟧 Orphelins Cosmident")
 
-df_filtered = df_final.copy()
-if show_only_both:
-    df_filtered = df_filtered[df_filtered["Statut Global"].str.startswith("🟩")]
-if show_only_one:
-    df_filtered = df_filtered[df_filtered["Statut Global"].str.startswith("🟦")]
-if show_only_none:
-    df_filtered = df_filtered[df_filtered["Statut Global"].str.startswith("🟥")]
-if show_only_orphans:
-    df_filtered = df_filtered[df_filtered["Statut Global"].str.startswith("🟧")]
+# Filtres cumulés (ET) sur la classe de ligne : masque de positions, pas de copie du tableau
+keep = np.ones(len(df_final), dtype=bool)
+for active, cls in ((show_only_both, "vert"), (show_only_one, "bleu"),
+                    (show_only_none, "rouge"), (show_only_orphans, "orange")):
+    if active:
+        keep &= (final_classes == cls)
 
 if show_only_both or show_only_one or show_only_none or show_only_orphans:
-    st.dataframe(df_filtered, use_container_width=True, hide_index=True)
+    show_page(df_final, np.flatnonzero(keep), final_classes, "filtre")
 
 # ==================== 5) TÉLÉCHARGEMENT ====================
-csv_out = df_final.to_csv(index=False, sep=";", encoding="utf-8-sig")
-st.download_button(
-    label="⬇️ Télécharger le tableau fusionné (CSV)",
-    data=csv_out,
-    file_name="Fusion_Resultat_Desmos_Cosmident.csv",
-    mime="text/csv",
-)
+download_buttons(df_final, "Fusion_Resultat_Desmos_Cosmident", "fusion")
 
 st.divider()
+
+show_diagnostics()
@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+"""
+Banc de mesure hors Streamlit :
+
+    python bench.py distance
+    python bench.py tokens [--pairs 20000] [--tolerance 0.2] [--show 20]
+    python bench.py cosmident [--pages 200] [--workers N]
+    python bench.py lexer [--lines 500000]
+    python bench.py pipeline [--scale 1k|10k|100k] [--match-workers N] [--save-baseline] [--baseline bench_baseline.json]
+
+- distance : vérifie que fuzzy_equal (noyau borné) rend exactement le même
+  booléen que l'ancien test `levenshtein(a, b) / L <= tol`, puis compare
+  les temps des deux approches ;
+- tokens : vérifie que match_tokens_count (couplage maximum) égale la force
+  brute, compare les temps au greedy d'origine et liste les paires de noms
+  où les deux comptes diffèrent ;
+- cosmident : extraction du PDF Cosmident en série vs pool de processus
+  (mêmes lignes attendues) ;
+- lexer : parseur de lignes Cosmident (lexer compilé + événements typés)
+  vs l'ancien parseur regex ligne à ligne : mêmes actes attendus sur des
+  factures générées et des lignes piégées, débit en lignes/s ;
+- pipeline : génère des fichiers réalistes (facturation avec blocs
+  « N° Dossier », PDF Cosmident « Ref. Patient », Desmos avec fautes et
+  nom/prénom inversés) à l'échelle demandée, chronomètre chaque étape,
+  relève son pic d'allocation (seconde passe sous tracemalloc, pic remis à
+  zéro à chaque étape : mémoire Python et numpy du processus, hors workers
+  et allocations C de PyMuPDF) et compare à une référence enregistrée :
+  étape plus lente que REGRESSION_RATIO × la référence ou tableau fusionné
+  différent -> code retour 1.
+"""
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import random
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+from extraction import (
+    PDF_WORKERS, display_frame, extract_billing_acts, extract_data_from_cosmident, iter_cosmident_events,
+    iter_cosmident_rows, read_desmos_excel,
+)
+from matching import (
+    FUZZY_REL_ERR, SCORE_THRESHOLD, canonical_tokens, clear_caches, fuzzy_equal, levenshtein, levenshtein_within,
+    make_index, match_tokens_count,
+)
+from pipeline import fuse
+
+ALPHABET = "abcdeilmnorstu'"
+TOLERANCES = [t / 100.0 for t in range(5, 41)]  # plage du curseur
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000}
+REGRESSION_RATIO = 1.25
+DEFAULT_BASELINE = Path("bench_baseline.json")
+
+# ==================== DISTANCE ====================
+def reference_fuzzy_equal(a: str, b: str, tol: float) -> bool:
+    """Ancienne implémentation (matrice complète puis comparaison)."""
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    L = max(len(a), len(b))
+    return (levenshtein(a, b) / L) <= tol
+
+
+def _mutate(rng: random.Random, w: str, n_edits: int) -> str:
+    for _ in range(n_edits):
+        i = rng.randrange(len(w) + 1)
+        op = rng.random()
+        if op < 0.33 and i < len(w):
+            w = w[:i] + w[i + 1:]
+        elif op < 0.66 and i < len(w):
+            w = w[:i] + rng.choice(ALPHABET) + w[i + 1:]
+        else:
+            w = w[:i] + rng.choice(ALPHABET) + w[i:]
+    return w
+
+
+def token_pairs(n: int, seed: int = 0, max_len: int = 90) -> list:
+    """Paires de tokens proches (quelques fautes) et sans rapport, longueurs 0..max_len."""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        la = rng.choice([rng.randint(0, 12), rng.randint(0, max_len)])
+        a = "".join(rng.choice(ALPHABET) for _ in range(la))
+        if rng.random() < 0.6:
+            b = _mutate(rng, a, rng.randint(0, 4))
+        else:
+            b = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 12)))
+        pairs.append((a, b))
+    return pairs
+
+
+def check_distance(n: int = 20000) -> int:
+    """Nombre de désaccords entre noyau borné et référence (doit être 0)."""
+    mismatches = 0
+    rng = random.Random(1)
+    for a, b in token_pairs(n):
+        tol = rng.choice(TOLERANCES)
+        if fuzzy_equal(a, b, tol) != reference_fuzzy_equal(a, b, tol):
+            mismatches += 1
+            print(f"  désaccord : {a!r} / {b!r} @ {tol}")
+        # le noyau lui-même, à tous les seuils autour de la vraie distance
+        d = levenshtein(a, b)
+        for k in (d - 1, d, d + 1):
+            if levenshtein_within(a, b, k) != (d <= k):
+                mismatches += 1
+                print(f"  désaccord noyau : {a!r} / {b!r} k={k} d={d}")
+    return mismatches
+
+
+def bench_distance(n: int = 20000, tol: float = 0.20) -> dict:
+    pairs = token_pairs(n, seed=2, max_len=20)
+    t0 = time.perf_counter()
+    for a, b in pairs:
+        reference_fuzzy_equal(a, b, tol)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for a, b in pairs:
+        fuzzy_equal(a, b, tol)
+    t_new = time.perf_counter() - t0
+    return {"paires": n, "reference_s": t_ref, "borne_s": t_new, "gain": t_ref / t_new if t_new else 0.0}
+
+# ==================== COUPLAGE DE TOKENS ====================
+def reference_match_tokens_count(ta: list, tb: list, tol: float) -> int:
+    """Ancienne implémentation (greedy : premier token de B libre et équivalent)."""
+    used_b = set()
+    k = 0
+    for a in ta:
+        for j, b in enumerate(tb):
+            if j in used_b:
+                continue
+            if a == b or fuzzy_equal(a, b, tol):
+                used_b.add(j)
+                k += 1
+                break
+    return k
+
+
+def brute_match_tokens_count(ta: list, tb: list, tol: float) -> int:
+    """Couplage maximum par énumération (petits noms seulement)."""
+    if len(ta) > len(tb):
+        ta, tb = tb, ta
+    best = 0
+    for perm in itertools.permutations(range(len(tb)), len(ta)):
+        best = max(best, sum(1 for a, j in zip(ta, perm) if a == tb[j] or fuzzy_equal(a, tb[j], tol)))
+    return best
+
+
+# prénoms proches les uns des autres (et de noms de famille) : cas où le greedy se trompe
+NEAR_NAMES = ["MARTINE", "JEANNE", "LOUISE", "PAULE", "MICHELLE", "DANIEL", "DANIELLE", "ANDRÉA", "MARIA",
+              "MARIO", "ROBERTE", "SIMONE", "DENIS", "DENISE", "MAURICE", "CLÉMENCE"]
+
+def name_pairs(n: int, seed: int = 0) -> list:
+    """Paires (tokens A, tokens B) : même patient ressaisi (fautes, prénoms composés) ou patients voisins."""
+    rng = random.Random(seed)
+    patients = make_patients(500, seed)
+    pairs = []
+    for _ in range(n):
+        a = rng.choice(patients)
+        if rng.random() < 0.3:
+            a += " " + rng.choice(FIRST_NAMES + NEAR_NAMES)
+        b = _typo_name(rng, a) if rng.random() < 0.7 else rng.choice(patients)
+        if rng.random() < 0.3:
+            b += " " + rng.choice([_mutate(rng, rng.choice(a.split(" ")).lower(), 1), rng.choice(NEAR_NAMES)])
+        pairs.append((canonical_tokens(a), canonical_tokens(b)))
+    return pairs
+
+
+def check_tokens(n: int = 5000) -> int:
+    """Désaccords entre match_tokens_count et la force brute (doit être 0)."""
+    mismatches = 0
+    rng = random.Random(3)
+    for ta, tb in name_pairs(n, seed=3):
+        tol = rng.choice(TOLERANCES)
+        if len(ta) <= 6 and len(tb) <= 6 and match_tokens_count(ta, tb, tol) != brute_match_tokens_count(ta, tb, tol):
+            mismatches += 1
+            print(f"  désaccord : {ta} / {tb} @ {tol}")
+    return mismatches
+
+
+def bench_tokens(n: int = 20000, tol: float = FUZZY_REL_ERR) -> dict:
+    """Temps greedy vs couplage maximum (cache de paires de tokens chaud pour les deux) + cas différents."""
+    pairs = name_pairs(n, seed=4)
+    clear_caches()
+    for ta, tb in pairs:  # même cache fuzzy_equal pour les deux mesures
+        reference_match_tokens_count(ta, tb, tol)
+    t0 = time.perf_counter()
+    greedy = [reference_match_tokens_count(ta, tb, tol) for ta, tb in pairs]
+    t_greedy = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    exact = [match_tokens_count(ta, tb, tol) for ta, tb in pairs]
+    t_cold = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for ta, tb in pairs:
+        match_tokens_count(ta, tb, tol)
+    t_warm = time.perf_counter() - t0
+    diffs = [(ta, tb, g, e) for (ta, tb), g, e in zip(pairs, greedy, exact) if g != e]
+    return {"paires": n, "greedy_s": t_greedy, "exact_froid_s": t_cold, "exact_chaud_s": t_warm,
+            "differences": diffs}
+
+# ==================== GÉNÉRATEURS DE FICHIERS ====================
+LAST_NAMES = [
+    "MARTIN", "BERNARD", "DUBOIS", "THOMAS", "ROBERT", "RICHARD", "PETIT", "DURAND", "LEROY", "MOREAU",
+    "SIMON", "LAURENT", "LEFÈBVRE", "MICHEL", "GARCIA", "DAVID", "BERTRAND", "ROUX", "VINCENT", "FOURNIER",
+    "MOREL", "GIRARD", "ANDRÉ", "LEFÈVRE", "MERCIER", "DUPONT", "LAMBERT", "BONNET", "FRANÇOIS", "MARTINEZ",
+    "LEGRAND", "GARNIER", "FAURE", "ROUSSEAU", "BLANC", "GUÉRIN", "MULLER", "HENRY", "ROUSSEL", "NICOLAS",
+    "PERRIN", "MORIN", "MATHIEU", "CLÉMENT", "GAUTHIER", "DUMONT", "LOPEZ", "FONTAINE", "CHEVALIER", "ROBIN",
+]
+FIRST_NAMES = [
+    "JEAN", "MARIE", "PIERRE", "ANNE", "LOUIS", "CLAIRE", "PAUL", "SOPHIE", "HÉLÈNE", "ÉRIC", "JACQUES",
+    "NATHALIE", "MICHEL", "ISABELLE", "ALAIN", "CATHERINE", "PHILIPPE", "FRANÇOISE", "BERNARD", "CHRISTINE",
+    "JEAN-PIERRE", "MARIE-CLAIRE", "LÉA", "HUGO", "CHLOÉ", "THÉO", "EMMA", "LUCAS", "JULIE", "NICOLAS",
+]
+BILLING_CODES = ["HBLD036", "HBLD090", "HBLD350", "HBLD634", "HBMD351", "HBLD490", "HBLD724", "HBQK002", "HBJD001"]
+ACTS = ["Couronne céramo-métallique", "Couronne zircone", "Inlay-core", "Bridge 3 éléments", "Couronne provisoire"]
+
+
+def make_patients(n: int, seed: int = 0) -> list:
+    """n noms « NOM PRÉNOM » (homonymes possibles, comme en vrai)."""
+    rng = random.Random(seed)
+    return [f"{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}" for _ in range(n)]
+
+
+def _typo_name(rng: random.Random, name: str) -> str:
+    """Nom tel que saisi ailleurs : faute de frappe, inversion nom/prénom, casse."""
+    parts = name.split(" ")
+    parts = [_mutate(rng, p.lower(), 1).upper() if rng.random() < 0.3 and len(p) > 4 else p for p in parts]
+    if rng.random() < 0.5:
+        parts = parts[::-1]
+    out = " ".join(parts)
+    return out.title() if rng.random() < 0.5 else out
+
+
+def make_billing_workbook(patients: list, n_acts: int, seed: int = 0) -> bytes:
+    """Export de facturation : blocs « NOM N° Dossier », en-têtes, lignes d'actes, blocs doublons."""
+    import openpyxl
+
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Factures")
+    ws.append(["Factures et Avoirs CENTRE DE SANTÉ DES LAURIERS"])
+    ws.append(["IMPRIMÉ LE 01/02/2024"])
+    written = 0
+    while written < n_acts:
+        p = rng.choice(patients)
+        ws.append([f"{p}  N° Dossier : {rng.randint(1000, 99999)}"])
+        ws.append(["DATE :", "N° FACT", "DENT(S)", "ACTE", "CODE", "HONO", "AMO"])
+        for _ in range(rng.randint(1, 6)):
+            ws.append([
+                f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2024", f"F{rng.randint(1, 99999)}",
+                rng.choice([11, 12, 21, 26, 36, 46, "14 15", ""]), rng.choice(ACTS), rng.choice(BILLING_CODES),
+                f"{rng.randint(50, 900)},{rng.randint(0, 99):02d}", f"{rng.randint(10, 120)},00",
+            ])
+            written += 1
+        if rng.random() < 0.02:
+            ws.append(["Factures et Avoirs CENTRE DE SANTÉ DES LAURIERS"])
+    ws.append(["TOTAL DES FACTURES", None, None, None, None, f"{rng.randint(1000, 99999)},00"])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def make_cosmident_pdf(n_pages: int, seed: int = 0, patients: list | None = None) -> bytes:
+    """PDF factice façon Cosmident : blocs « Ref. Patient » + actes + pied de page."""
+    import fitz
+
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for p in range(n_pages):
+        page = doc.new_page()
+        y = 50
+        for _ in range(8):
+            if patients and rng.random() < 0.9:
+                name = _typo_name(rng, rng.choice(patients))
+            else:
+                name = f"PATIENT{rng.randint(1, 5000)} NOM{rng.randint(1, 5000)}"
+            for line in (f"Ref. Patient : {name}", rng.choice(ACTS),
+                         f"1 {rng.randint(40, 400)},00 {rng.randint(40, 400)},00", "Teinte A2"):
+                page.insert_text((40, y), line)
+                y += 14
+        page.insert_text((40, y + 20), f"TOTAL TTC {rng.randint(1000, 9000)},00  IBAN FR76 0000")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def make_desmos_workbook(patients: list, n_rows: int, seed: int = 0) -> bytes:
+    """Export Desmos : noms avec fautes / inversions, prix au format « 123,45 € »."""
+    rng = random.Random(seed)
+    df = pd.DataFrame({
+        "Nom patient": [_typo_name(rng, rng.choice(patients)) for _ in range(n_rows)],
+        "Libellé acte": [rng.choice(ACTS) for _ in range(n_rows)],
+        "Prix": [f"{rng.randint(100, 900)},{rng.randint(0, 99):02d} €" for _ in range(n_rows)],
+    })
+    buf = io.BytesIO()
+    df.to_excel(buf, index=False, engine="openpyxl")
+    return buf.getvalue()
+
+
+def make_dataset(n_acts: int, seed: int = 0) -> dict:
+    """Trois fichiers cohérents (mêmes patients) pour ~n_acts actes facturés."""
+    patients = make_patients(max(10, n_acts // 3), seed)
+    return {
+        "facturation": make_billing_workbook(patients, n_acts, seed),
+        "cosmident": make_cosmident_pdf(max(1, n_acts // 2 // 8), seed, patients),
+        "desmos": make_desmos_workbook(patients, max(10, n_acts // 2), seed),
+    }
+
+def bench_cosmident(n_pages: int = 200, workers: int = PDF_WORKERS) -> dict:
+    pdf = make_cosmident_pdf(n_pages)
+    t0 = time.perf_counter()
+    df_serial, _ = extract_data_from_cosmident(pdf, workers=1)
+    t_serial = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    df_pool, _ = extract_data_from_cosmident(pdf, workers=workers)
+    t_pool = time.perf_counter() - t0
+    return {"pages": n_pages, "workers": workers, "lignes": len(df_serial),
+            "identique": df_serial.equals(df_pool),
+            "serie_s": t_serial, "pool_s": t_pool}
+
+
+# ==================== PIPELINE COMPLET ====================
+def _run_stages(files: dict, stage, workers: int | None, match_workers: int | None) -> tuple:
+    """Étapes du pipeline, chacune passée à stage(nom, fn) : (df_result, df_cos, df_des, df_final, orphelins)."""
+    df_result = stage("facturation", lambda: extract_billing_acts(
+        pd.read_excel(io.BytesIO(files["facturation"]), header=None, engine="openpyxl")))
+    df_cos = stage("cosmident", lambda: extract_data_from_cosmident(files["cosmident"], workers=workers)[0])
+    df_des = stage("desmos", lambda: read_desmos_excel(io.BytesIO(files["desmos"]), xlsx=True))
+    index_res, index_des, index_cos = stage("index", lambda: (
+        make_index(df_result, "Patient"), make_index(df_des, "Patient"), make_index(df_cos, "Patient")))
+    df_final, n_orphans = stage("matching", lambda: fuse(
+        df_result, df_cos, index_res, index_des, index_cos, SCORE_THRESHOLD, FUZZY_REL_ERR,
+        match_workers=match_workers))
+    return df_result, df_cos, df_des, df_final, n_orphans
+
+
+def bench_pipeline(n_acts: int, seed: int = 0, workers: int | None = None,
+                   match_workers: int | None = None) -> dict:
+    """
+    Temps par étape (passe sans traçage), puis pic d'allocation par étape
+    (seconde passe sous tracemalloc, caches vidés) + empreinte du tableau fusionné.
+    """
+    clear_caches()
+    t0 = time.perf_counter()
+    files = make_dataset(n_acts, seed)
+    stages = {}
+    report = {"actes": n_acts, "generation_s": time.perf_counter() - t0, "etapes": stages}
+
+    def timed(name, fn):
+        t = time.perf_counter()
+        out = fn()
+        stages[name] = {"s": time.perf_counter() - t}
+        return out
+
+    def traced(name, fn):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        out = fn()
+        _, peak = tracemalloc.get_traced_memory()
+        stages[name]["pic_mo"] = (peak - before) / (1024 * 1024)
+        return out
+
+    df_result, df_cos, df_des, df_final, n_orphans = _run_stages(files, timed, workers, match_workers)
+    clear_caches()
+    tracemalloc.start()
+    try:
+        _run_stages(files, traced, workers, match_workers)
+    finally:
+        tracemalloc.stop()
+
+    report["lignes"] = {"resultat": len(df_result), "cosmident": len(df_cos), "desmos": len(df_des),
+                        "fusion": len(df_final), "orphelins": n_orphans}
+    report["empreinte"] = hashlib.sha256(
+        display_frame(df_final).to_csv(index=False, sep=";").encode("utf-8")).hexdigest()
+    report["total_s"] = sum(s["s"] for s in stages.values())
+    return report
+
+
+def compare_to_baseline(report: dict, baseline: dict) -> list:
+    """Régressions (temps au-delà de REGRESSION_RATIO × référence, sortie différente)."""
+    problems = []
+    if baseline.get("empreinte") != report["empreinte"]:
+        problems.append("tableau fusionné différent de la référence")
+    for name, s in report["etapes"].items():
+        ref = baseline.get("etapes", {}).get(name)
+        if ref and s["s"] > REGRESSION_RATIO * ref["s"]:
+            problems.append(f"{name} : {s['s']:.2f}s contre {ref['s']:.2f}s (x{s['s'] / ref['s']:.2f})")
+    return problems
+
+
+def print_pipeline(report: dict, baseline: dict | None):
+    print(f"{report['actes']} actes (génération {report['generation_s']:.1f}s) — lignes : {report['lignes']}")
+    for name, s in report["etapes"].items():
+        ref = (baseline or {}).get("etapes", {}).get(name)
+        delta = f"  (réf. {ref['s']:.2f}s)" if ref else ""
+        print(f"  {name:<12} {s['s']:8.2f}s   pic mémoire {s['pic_mo']:8.1f} Mo{delta}")
+    print(f"  {'total':<12} {report['total_s']:8.2f}s")
+
+
+# ==================== PARSEUR DE LIGNES COSMIDENT (référence vs lexer) ====================
+def reference_cosmident_rows(page_texts):
+    """Ancien parseur : regex non compilées, plusieurs passes par ligne, prix flottants."""
+    rows = []
+    current_patient = None
+    current_description = ""
+    current_numbers = []
+
+    def close(require_patient: bool):
+        if (current_patient or not require_patient) and current_description and current_numbers:
+            total = float(str(current_numbers[-1]).replace(",", "."))
+            if total > 0:
+                rows.append((current_patient.strip(), current_description.strip(), round(total * 100)))
+
+    for page_text in page_texts:
+        for line in page_text.split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            if re.search(r"(teinte|couleur|A[1-3]|B[1-3]|C[1-3]|D[1-3])", line, re.IGNORECASE):
+                continue
+            if re.search(r"(COSMIDENT|IBAN|Siret|BIC|€|TOTAL TTC|CHÈQUE|NOS COORDONNÉES|BANCAIRES)", line,
+                         re.IGNORECASE):
+                continue
+            ref_match = re.search(r"Ref\.?\s*(?:Patient\s*)?:?\s*([\w\s\-'’]+)", line, re.IGNORECASE)
+            if ref_match:
+                close(require_patient=True)
+                current_patient = ref_match.group(1).strip()
+                current_description = ""
+                current_numbers = []
+                continue
+            if current_patient is None:
+                continue
+            this_numbers = re.findall(r"\d+[\.,]\d{2}", line)
+            norm_numbers = [n.replace(",", ".") for n in this_numbers]
+            this_text = re.sub(r"\s*\d+[\.,]\d{2}\s*", " ", line).strip()
+            if this_text:
+                if current_description and current_numbers:
+                    close(require_patient=False)
+                    current_description = ""
+                    current_numbers = []
+                current_description = (current_description + " " + this_text).strip()
+            if norm_numbers:
+                current_numbers.extend(norm_numbers)
+    close(require_patient=True)
+    return rows
+
+
+# fragments de lignes piégées : montants collés, zéros, références vides, teintes, pieds de page
+LINE_PIECES = ["Ref. Patient : DUPONT Jean", "REF: MARTIN", "Ref :", "Prefab inlay", "Couronne zircone",
+               "1", "0,00", "12,5", "120,00", "45.90", "1 234,56", "3,14159", "x2", "Teinte A2", "a3",
+               "IBAN FR76", "Total (Euros)", "-", "  ", "Bridge 3 éléments", "O'NEIL Anne-Marie"]
+
+def cosmident_page_texts(n_lines: int, seed: int = 0) -> list:
+    """Texte de pages façon Cosmident (blocs réalistes) entrecoupé de lignes piégées."""
+    rng = random.Random(seed)
+    pages, lines = [], []
+    while sum(map(len, pages)) + len(lines) < n_lines:
+        if rng.random() < 0.7:
+            lines += [f"Ref. Patient : {rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)}", rng.choice(ACTS),
+                      f"1 {rng.randint(40, 400)},00 {rng.randint(40, 400)},00", "Teinte A2"]
+        else:
+            lines.append(" ".join(rng.choice(LINE_PIECES) for _ in range(rng.randint(1, 3))))
+        if len(lines) >= 40:
+            pages.append(lines)
+            lines = []
+    pages.append(lines)
+    return ["\n".join(p) for p in pages]
+
+
+def bench_lexer(n_lines: int = 500_000) -> dict:
+    texts = cosmident_page_texts(n_lines)
+    t0 = time.perf_counter()
+    ref = reference_cosmident_rows(texts)
+    t_ref = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = list(iter_cosmident_rows(iter_cosmident_events(texts)))
+    t_new = time.perf_counter() - t0
+    return {"lignes": n_lines, "actes": len(ref), "identique": ref == new,
+            "reference_lps": n_lines / t_ref, "lexer_lps": n_lines / t_new, "gain": t_ref / t_new}
+
+
+# ==================== CLI ====================
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Bancs de mesure CDS2 (hors Streamlit).")
+    sub = parser.add_subparsers(dest="what")
+    sub.add_parser("distance")
+    p_tok = sub.add_parser("tokens")
+    p_tok.add_argument("--pairs", type=int, default=20000)
+    p_tok.add_argument("--tolerance", type=float, default=FUZZY_REL_ERR)
+    p_tok.add_argument("--show", type=int, default=20, help="cas différents affichés")
+    p_cos = sub.add_parser("cosmident")
+    p_cos.add_argument("--pages", type=int, default=200)
+    p_cos.add_argument("--workers", type=int, default=PDF_WORKERS)
+    p_lex = sub.add_parser("lexer")
+    p_lex.add_argument("--lines", type=int, default=500_000)
+    p_pipe = sub.add_parser("pipeline")
+    p_pipe.add_argument("--scale", choices=list(SCALES), default="1k")
+    p_pipe.add_argument("--seed", type=int, default=0)
+    p_pipe.add_argument("--workers", type=int, default=None)
+    p_pipe.add_argument("--match-workers", type=int, default=None)
+    p_pipe.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    p_pipe.add_argument("--save-baseline", action="store_true", help="enregistre ce run comme référence")
+    args = parser.parse_args(argv)
+
+    if args.what in (None, "distance"):
+        bad = check_distance()
+        print(f"Équivalence fuzzy_equal : {'OK' if bad == 0 else f'{bad} désaccord(s)'}")
+        r = bench_distance()
+        print(f"{r['paires']} paires : référence {r['reference_s']:.3f}s | borné {r['borne_s']:.3f}s | x{r['gain']:.1f}")
+        return 1 if bad else 0
+
+    if args.what == "tokens":
+        bad = check_tokens()
+        print(f"Couplage maximum vs force brute : {'OK' if bad == 0 else f'{bad} désaccord(s)'}")
+        r = bench_tokens(args.pairs, args.tolerance)
+        print(f"{r['paires']} paires : greedy {r['greedy_s']:.3f}s | couplage maximum {r['exact_froid_s']:.3f}s "
+              f"(cache chaud {r['exact_chaud_s']:.3f}s) | {len(r['differences'])} paire(s) différente(s)")
+        for ta, tb, g, e in r["differences"][:args.show]:
+            print(f"  {' '.join(ta)!r} / {' '.join(tb)!r} : greedy {g} -> maximum {e}")
+        return 1 if bad else 0
+
+    if args.what == "cosmident":
+        r = bench_cosmident(args.pages, args.workers)
+        print(f"{r['pages']} pages, {r['lignes']} lignes : série {r['serie_s']:.2f}s | "
+              f"pool x{r['workers']} {r['pool_s']:.2f}s | identique : {r['identique']}")
+        return 0 if r["identique"] else 1
+
+    if args.what == "lexer":
+        r = bench_lexer(args.lines)
+        print(f"{r['lignes']} lignes, {r['actes']} actes : référence {r['reference_lps']:,.0f} lignes/s | "
+              f"lexer {r['lexer_lps']:,.0f} lignes/s | x{r['gain']:.1f} | identique : {r['identique']}")
+        return 0 if r["identique"] else 1
+
+    report = bench_pipeline(SCALES[args.scale], args.seed, args.workers, args.match_workers)
+    baselines = json.loads(args.baseline.read_text(encoding="utf-8")) if args.baseline.exists() else {}
+    key = f"{args.scale}:{args.seed}"
+    print_pipeline(report, baselines.get(key))
+    if args.save_baseline:
+        baselines[key] = report
+        args.baseline.write_text(json.dumps(baselines, indent=2, ensure_ascii=False), encoding="utf-8")
+        print(f"Référence enregistrée dans {args.baseline} ({key})")
+        return 0
+    if key not in baselines:
+        print("Pas de référence pour cette échelle (--save-baseline pour en créer une).")
+        return 0
+    problems = compare_to_baseline(report, baselines[key])
+    for p in problems:
+        print(f"  RÉGRESSION : {p}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,860 @@
+# -*- coding: utf-8 -*-
+"""
+Extraction des sources (sans dépendance Streamlit).
+
+- extract_billing_acts : actes prothétiques de l'Excel de facturation (§1) ;
+- iter_billing_acts / iter_excel_rows : même extraction en flux, ligne à ligne,
+  pour les exports trop gros pour tenir en DataFrame ;
+- extract_data_from_cosmident : lignes du PDF Cosmident, texte des pages
+  extrait en parallèle (pool de processus) et parsé au fil de l'eau ; en
+  mode ocr, les pages scannées (sans couche texte) passent par Tesseract,
+  avec un cache disque du texte OCR par hash de l'image de page ;
+- read_desmos_excel : export Desmos ramené aux colonnes Patient/Acte/Prix.
+
+Colonnes typées : noms / codes / actes en catégories, dents en Int8, prix en
+centimes entiers (Int64, <NA> si absent) ; display_frame les remet en texte
+pour l'affichage et les exports CSV.
+
+Les fonctions lèvent leurs erreurs de lecture : l'appelant les affiche.
+"""
+import hashlib
+import json
+import os
+import re
+import unicodedata
+from array import array
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+import fitz  # PyMuPDF
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:  # OCR facultatif : seuls les PDF scannés en ont besoin
+    pytesseract = None
+
+# À incrémenter dès qu'un parseur change de sortie : invalide les caches d'uploads
+PARSER_VERSION = 2
+
+# ==================== COLONNES TYPÉES ====================
+# Prix en centimes -> texte : séparateur décimal de chaque colonne
+PRICE_COLUMNS = {"Tarif": ",", "Prix Cosmident": ".", "Prix Desmos": ".",
+                 "Écart Desmos": ".", "Écart Cosmident": "."}
+INT_NA = -(1 << 63)  # valeur absente dans les buffers d'entiers
+
+
+def to_cents(values) -> pd.Series:
+    """Montants (« 123,45 », « 123.4 », « 123 », nombres) -> centimes entiers (Int64, <NA> si illisible)."""
+    s = (values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)).astype(str)
+    num = pd.to_numeric(s.str.replace(" ", "", regex=False).str.replace(",", ".", regex=False), errors="coerce")
+    return (num * 100).round().astype("Int64")
+
+
+def format_cents(cents, sep: str = ".") -> pd.Series:
+    """Centimes -> « 123.45 » (texte objet, <NA> conservé)."""
+    c = pd.Series(cents).astype("Int64")
+    filled = c.fillna(0).astype("int64")
+    a = filled.abs()
+    txt = (a // 100).astype(str) + sep + (a % 100).astype(str).str.zfill(2)
+    txt = txt.where(filled >= 0, "-" + txt)
+    return txt.astype(object).where(c.notna(), None)
+
+
+def display_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copie texte pour l'affichage / le CSV : prix « 123,45 » (Tarif) ou « 123.45 »,
+    dent sur 2 chiffres ; valeur absente « ? » sur un acte facturé, vide ailleurs.
+    """
+    out = df.copy()
+    is_act = out["Code"].astype(str).ne("").to_numpy() if "Code" in out.columns else np.zeros(len(out), bool)
+    missing = np.where(is_act, "?", "")
+    for col, sep in PRICE_COLUMNS.items():
+        if col in out.columns and pd.api.types.is_integer_dtype(out[col]):
+            txt = format_cents(out[col], sep).to_numpy(dtype=object)
+            out[col] = np.where(pd.isna(txt), missing if col == "Tarif" else "", txt)
+    if "Dent" in out.columns and pd.api.types.is_integer_dtype(out["Dent"]):
+        dent = out["Dent"].astype("Int64")
+        txt = dent.astype(str).str.zfill(2).to_numpy(dtype=object)
+        out["Dent"] = np.where(dent.isna().to_numpy(), missing, txt)
+    return out
+
+
+class ColumnBuffer:
+    """
+    Lignes (tuples dans l'ordre de `columns`) accumulées colonne par colonne :
+    textes internés (codes int32 + table des valeurs, -> Categorical), entiers
+    dans des array typés (-> type nullable de `int_dtypes`, None = <NA>).
+    """
+
+    def __init__(self, columns: list, int_dtypes: dict):
+        self.columns = list(columns)
+        self.int_dtypes = int_dtypes
+        self._data = [array("q") if c in int_dtypes else array("i") for c in self.columns]
+        self._intern = [None if c in int_dtypes else {} for c in self.columns]
+
+    def append(self, row: tuple):
+        for buf, intern, v in zip(self._data, self._intern, row):
+            if intern is None:
+                buf.append(INT_NA if v is None else v)
+            else:
+                buf.append(intern.setdefault(v, len(intern)))
+
+    def __len__(self) -> int:
+        return len(self._data[0])
+
+    def frame(self) -> pd.DataFrame:
+        cols = {}
+        for c, buf, intern in zip(self.columns, self._data, self._intern):
+            values = np.frombuffer(buf, dtype=np.int64 if intern is None else np.int32) if len(buf) else \
+                np.empty(0, dtype=np.int64 if intern is None else np.int32)
+            if intern is None:
+                mask = values == INT_NA
+                dtype = pd.api.types.pandas_dtype(self.int_dtypes[c])
+                cols[c] = pd.arrays.IntegerArray(np.where(mask, 0, values).astype(dtype.numpy_dtype), mask)
+            else:
+                cols[c] = pd.Categorical.from_codes(values, categories=list(intern))
+        return pd.DataFrame(cols, columns=self.columns)
+
+
+# ==================== 1) FACTURATION ====================
+ACTS_COLUMNS = ["Patient", "Dent", "Code", "Acte", "Tarif"]
+ACTS_INT_DTYPES = {"Dent": "Int8", "Tarif": "Int64"}
+EMPTY_CELLS = ["nan", "None", ""]
+IGNORED_CODES = ["HBLD490", "HBLD045", "HBLD724"]
+
+# Motifs compilés une seule fois (et non à chaque ligne)
+RESET_PATTERN = re.compile(r"Factures et Avoirs CENTRE DE SANTÉ DES LAURIERS", re.I)
+DOSSIER_PATTERN = re.compile(r"N°\s*Dossier", re.I)
+PATIENT_PATTERN = re.compile(r"([A-ZÉÈÊËÀÂÄÔÖÙÛÜÇ][A-ZÉÈÊËÀÂÄÔÖÙÛÜÇ'\- ]{4,80})\s+N°\s*Dossier", re.I)
+HEADER_PATTERN = re.compile("|".join(f"(?:{p})" for p in [
+    r"^DATE[\s:]", r"^N°\s*FACT", r"^DENT\(S\)", r"^ACTE$", r"^HONO", r"^AMO$",
+    r"^TOTAL DES FACTURES", r"^IMPRIMÉ LE"
+]))
+TARIF_PATTERN = re.compile(r"^\d{1,6}[,.]?\d{0,2}$")
+DENT_PATTERN = re.compile(r"\b([1-4]?\d)\b")
+TARIF_OFFSETS = (1, 2)   # cellules après le code
+DENT_LOOKBACK = 19       # cellules avant le code
+ACTE_LOOKBACK = 29
+
+_to_text = np.frompyfunc(lambda v: str(v).strip(), 1, 1)
+
+
+def _str(values) -> pd.Series:
+    """Série objet (regex Python, comme l'ancienne boucle)."""
+    return pd.Series(values, dtype=object)
+
+
+def extract_billing_acts(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    Actes HBLD* / HBMD351 / HBLD634 de la feuille brute (lue avec header=None).
+
+    Traitement par colonnes : texte des cellules calculé une fois, patient
+    courant propagé par ffill entre les lignes « N° Dossier » et les blocs
+    « Factures et Avoirs », puis tarif / dent / acte cherchés par décalage
+    autour de la cellule code pour toutes les lignes retenues à la fois.
+    """
+    if df_raw is None or df_raw.empty:
+        return ColumnBuffer(ACTS_COLUMNS, ACTS_INT_DTYPES).frame()
+
+    txt = _to_text(df_raw.to_numpy(dtype=object))
+    n_rows, n_cols = txt.shape
+    filled = ~np.isin(txt, EMPTY_CELLS)
+
+    # Texte de ligne = cellules non vides jointes par un espace
+    row_text = np.full(n_rows, "", dtype=object)
+    for j in range(n_cols):
+        row_text = np.where(filled[:, j], row_text + " " + txt[:, j], row_text)
+    row_text = _str(row_text).str.slice(1)
+
+    # Patient courant : remis à zéro par un bloc doublon Factures/Avoirs,
+    # fixé par une ligne « N° Dossier » dont le nom est lisible
+    reset = row_text.str.contains(RESET_PATTERN).to_numpy(dtype=bool)
+    dossier = row_text.str.contains(DOSSIER_PATTERN).to_numpy(dtype=bool) & ~reset
+    names = row_text[dossier].str.extract(PATIENT_PATTERN, expand=False).dropna().str.strip()
+    state = pd.Series(np.nan, index=row_text.index, dtype=object)
+    state[reset] = ""
+    state[names.index] = names
+    patient = state.ffill().fillna("").to_numpy(dtype=object)
+
+    header = row_text.str.upper().str.contains(HEADER_PATTERN).to_numpy(dtype=bool)
+
+    # Première cellule code de chaque ligne
+    is_code = np.zeros((n_rows, n_cols), dtype=bool)
+    for j in range(n_cols):
+        col = _str(txt[:, j])
+        is_code[:, j] = (col.str.startswith("HBLD") | (col == "HBMD351")).to_numpy(dtype=bool)
+    code_idx = is_code.argmax(axis=1)
+    code = txt[np.arange(n_rows), code_idx]
+
+    keep = (
+        is_code.any(axis=1) & ~reset & ~dossier & ~header
+        & ~np.isin(code, IGNORED_CODES) & (patient != "")
+    )
+    rows = np.flatnonzero(keep)
+    ci = code_idx[rows]
+    n = len(rows)
+
+    # Tarif : première des cellules suivantes qui ressemble à un montant
+    tarif = np.full(n, None, dtype=object)
+    found = np.zeros(n, dtype=bool)
+    for offset in TARIF_OFFSETS:
+        pos = ci + offset
+        sel = np.flatnonzero(~found & (pos < n_cols))
+        vals = _str(txt[rows[sel], pos[sel]]).str.replace(" ", "", regex=False)
+        hit = vals.str.replace(",", ".", regex=False).str.match(TARIF_PATTERN).to_numpy(dtype=bool)
+        tarif[sel[hit]] = vals[hit].str.replace(".", ",", regex=False).to_numpy(dtype=object)
+        found[sel[hit]] = True
+
+    # Dent : premier numéro 1..48 en remontant avant le code
+    dent = np.zeros(n, dtype=np.int8)
+    found = np.zeros(n, dtype=bool)
+    for offset in range(1, DENT_LOOKBACK + 1):
+        pos = ci - offset
+        sel = np.flatnonzero(~found & (pos >= 0))
+        if not len(sel):
+            continue
+        num = _str(txt[rows[sel], pos[sel]]).str.extract(DENT_PATTERN, expand=False)
+        val = pd.to_numeric(num, errors="coerce")
+        hit = (val.between(1, 48)).to_numpy(dtype=bool)
+        dent[sel[hit]] = val[hit].to_numpy(dtype=np.int8)
+        found[sel[hit]] = True
+
+    # Description acte : première cellule non vide avant le code
+    acte = np.full(n, "?", dtype=object)
+    found = np.zeros(n, dtype=bool)
+    for offset in range(1, ACTE_LOOKBACK + 1):
+        pos = ci - offset
+        sel = np.flatnonzero(~found & (pos >= 0))
+        if not len(sel):
+            continue
+        hit = filled[rows[sel], pos[sel]]
+        acte[sel[hit]] = txt[rows[sel[hit]], pos[sel[hit]]]
+        found[sel[hit]] = True
+
+    return pd.DataFrame({
+        "Patient": pd.Categorical(patient[rows]),
+        "Dent": pd.arrays.IntegerArray(dent, dent == 0),
+        "Code": pd.Categorical(code[rows]),
+        "Acte": pd.Categorical(acte),
+        "Tarif": to_cents(tarif).array,
+    }, columns=ACTS_COLUMNS)
+
+
+# ==================== 1bis) FACTURATION EN FLUX (mémoire bornée) ====================
+def _cell_value(v):
+    """Valeur de cellule comme la rend pd.read_excel (numériques entiers -> int)."""
+    if isinstance(v, float) and v == v and v not in (float("inf"), float("-inf")) and v.is_integer():
+        return int(v)
+    return v
+
+
+def iter_excel_rows(file, xlsx: bool = True, columns: list | None = None):
+    """
+    Lignes (tuples de valeurs) de la première feuille, sans DataFrame intermédiaire.
+    Flux réel seulement pour .xlsx (openpyxl en lecture seule) ; xlrd ne sait pas
+    lire un .xls en flux : le fichier entier est chargé en mémoire, seules les
+    lignes sont ensuite rendues une à une.
+    columns : indices (base 0) des seules colonnes rendues, dans cet ordre.
+    """
+    if xlsx:
+        import openpyxl
+
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            if columns is None:
+                for row in wb.worksheets[0].iter_rows(values_only=True):
+                    yield tuple(_cell_value(v) for v in row)
+            else:
+                lo = min(columns)
+                picks = [c - lo for c in columns]
+                for row in wb.worksheets[0].iter_rows(min_col=lo + 1, max_col=max(columns) + 1, values_only=True):
+                    yield tuple(_cell_value(row[c]) if c < len(row) else None for c in picks)
+        finally:
+            wb.close()
+    else:
+        import xlrd
+
+        if hasattr(file, "read"):
+            data = file.read()
+        else:
+            with open(file, "rb") as fh:
+                data = fh.read()
+        book = xlrd.open_workbook(file_contents=data, on_demand=True)
+
+        def value(c):
+            if c.ctype == xlrd.XL_CELL_DATE:
+                try:
+                    return xlrd.xldate.xldate_as_datetime(c.value, book.datemode)
+                except (OverflowError, xlrd.xldate.XLDateError):
+                    return c.value
+            if c.ctype in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR):
+                return None
+            if c.ctype == xlrd.XL_CELL_BOOLEAN:
+                return bool(c.value)
+            return _cell_value(c.value)
+
+        try:
+            sheet = book.sheet_by_index(0)
+            for r in range(sheet.nrows):
+                cells = sheet.row(r)
+                if columns is None:
+                    yield tuple(value(c) for c in cells)
+                else:
+                    yield tuple(value(cells[c]) if c < len(cells) else None for c in columns)
+        finally:
+            book.release_resources()
+
+
+def iter_billing_acts(rows):
+    """
+    Machine à états du §1 sur un itérable de lignes : produit chaque acte
+    (tuple Patient, Dent, Code, Acte, Tarif en centimes ; None si absent)
+    dès qu'il est lu. collect_billing_acts en fait le DataFrame typé.
+    """
+    current_patient = None
+    for raw in rows:
+        values = ["nan" if v is None else str(v).strip() for v in raw]
+        row_text = " ".join(v for v in values if v not in EMPTY_CELLS)
+
+        # Réinitialisation sur bloc doublon Factures/Avoirs
+        if RESET_PATTERN.search(row_text):
+            current_patient = None
+            continue
+
+        # Détection patient
+        if DOSSIER_PATTERN.search(row_text):
+            m = PATIENT_PATTERN.search(row_text)
+            if m:
+                current_patient = m.group(1).strip()
+            continue
+
+        # En-têtes à ignorer
+        if HEADER_PATTERN.search(row_text.upper()):
+            continue
+
+        # Recherche du code cible
+        code_idx = next((i for i, v in enumerate(values) if v.startswith("HBLD") or v == "HBMD351"), -1)
+        if code_idx < 0:
+            continue
+        code = values[code_idx]
+        if code in IGNORED_CODES or not current_patient:
+            continue
+
+        tarif = None
+        for offset in TARIF_OFFSETS:
+            if code_idx + offset < len(values):
+                val = values[code_idx + offset].replace(" ", "").replace(",", ".")
+                if TARIF_PATTERN.match(val):
+                    tarif = round(float(val) * 100)
+                    break
+
+        dent = None
+        for i in range(code_idx - 1, max(-1, code_idx - DENT_LOOKBACK - 1), -1):
+            m = DENT_PATTERN.search(values[i])
+            if m and 1 <= int(m.group(1)) <= 48:
+                dent = int(m.group(1))
+                break
+
+        acte = "?"
+        for i in range(code_idx - 1, max(-1, code_idx - ACTE_LOOKBACK - 1), -1):
+            if values[i] not in EMPTY_CELLS:
+                acte = values[i]
+                break
+
+        yield (current_patient, dent, code, acte, tarif)
+
+
+def collect_billing_acts(acts) -> pd.DataFrame:
+    """Actes produits par iter_billing_acts -> DataFrame typé (sans dict par ligne)."""
+    buf = ColumnBuffer(ACTS_COLUMNS, ACTS_INT_DTYPES)
+    for act in acts:
+        buf.append(act)
+    return buf.frame()
+
+
+# ==================== 2) COSMIDENT (PDF) ====================
+COSMIDENT_COLUMNS = ["Patient", "Acte Cosmident", "Prix Cosmident"]
+COSMIDENT_INT_DTYPES = {"Prix Cosmident": "Int64"}
+COSMIDENT_STOP_PATTERN = re.compile(
+    r"(COSMIDENT|IBAN|Siret|BIC|Tél\.|Total \(Euros\)|TOTAL TTC|Règlement|Chèque|NOS COORDONNÉES BANCAIRES)",
+    re.IGNORECASE,
+)
+PDF_WORKERS = min(8, os.cpu_count() or 1)
+PDF_PARALLEL_MIN_PAGES = 16  # en dessous, le démarrage du pool coûte plus qu'il ne rapporte
+PDF_PAGES_PER_TASK = 8
+
+# Repli OCR des pages scannées
+OCR_MIN_CHARS = 20      # en dessous (hors espaces), la page est considérée sans couche texte
+OCR_DPI = 300           # résolution usuelle de Tesseract : plus bas perd les virgules des montants
+OCR_LANG = "fra"
+OCR_CONFIG = "--oem 1 --psm 4"  # LSTM, colonne de lignes de tailles variables (lignes de facture conservées)
+OCR_CACHE_DIR = ".ocr_cache"
+
+
+def _tesseract_available() -> bool:
+    """pytesseract importable et binaire tesseract trouvé."""
+    if pytesseract is None:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception:
+        return False
+    return True
+
+
+OCR_AVAILABLE = _tesseract_available()
+# échecs d'une page (image illisible, erreur Tesseract, binaire introuvable) : la couche texte est gardée
+OCR_PAGE_ERRORS = (OSError,) if pytesseract is None else (pytesseract.TesseractError, OSError)
+
+_worker_doc = None  # document ouvert une fois par processus du pool
+_worker_ocr = None  # (dossier de cache, dpi) des processus OCR
+
+
+def _truncate_page(page_text: str) -> str:
+    """Texte de la page jusqu'au premier pied de page (coordonnées, totaux…)."""
+    m = COSMIDENT_STOP_PATTERN.search(page_text)
+    return page_text[:m.start()] if m else page_text
+
+
+def _init_pdf_worker(pdf_bytes: bytes):
+    global _worker_doc
+    _worker_doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+
+
+def _page_text(page) -> tuple[str, bool]:
+    """(texte tronqué, page scannée ?) : scannée = couche texte quasi vide."""
+    text = page.get_text("text")
+    return _truncate_page(text), len("".join(text.split())) < OCR_MIN_CHARS
+
+
+def _pdf_page_text(page_no: int) -> tuple[str, bool]:
+    return _page_text(_worker_doc[page_no])
+
+
+def iter_text_layer(pdf_bytes: bytes, workers: int | None = None):
+    """
+    (texte tronqué, page scannée ?) de chaque page, dans l'ordre.
+    Pool de processus (chaque worker ouvre le PDF depuis les octets partagés)
+    si le document est assez long ; repli en série sinon ou si le pool échoue.
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    n_pages = doc.page_count
+    done = 0
+    if workers > 1 and n_pages >= PDF_PARALLEL_MIN_PAGES:
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_pdf_worker,
+                                     initargs=(pdf_bytes,)) as pool:
+                for text in pool.map(_pdf_page_text, range(n_pages), chunksize=PDF_PAGES_PER_TASK):
+                    yield text
+                    done += 1
+            return
+        except (BrokenProcessPool, OSError):
+            pass  # repli série sur les pages restantes
+    for page_no in range(done, n_pages):
+        yield _page_text(doc[page_no])
+
+
+def ocr_page(page, cache_dir=OCR_CACHE_DIR, dpi: int = OCR_DPI) -> str:
+    """
+    Texte OCR (non tronqué) d'une page rendue en niveaux de gris à `dpi`.
+    Cache disque : <cache_dir>/<hash[:2]>/<hash>.txt, hash de l'image rendue
+    et des réglages Tesseract ; la même facture n'est jamais OCRisée deux fois.
+    """
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    h = hashlib.sha256(f"{pix.width}x{pix.height}:{OCR_LANG}:{OCR_CONFIG}:".encode())
+    h.update(pix.samples_mv)
+    digest = h.hexdigest()
+    path = os.path.join(cache_dir, digest[:2], f"{digest}.txt") if cache_dir else None
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    if pytesseract is None:
+        raise ImportError("OCR des pages scannées : installer pytesseract (et le binaire tesseract)")
+    image = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    text = pytesseract.image_to_string(image, lang=OCR_LANG, config=OCR_CONFIG)
+    if path:
+        # écriture atomique : plusieurs workers peuvent viser la même entrée
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return text
+
+
+def _init_ocr_worker(pdf_bytes: bytes, cache_dir, dpi: int):
+    global _worker_ocr
+    # un fil Tesseract par processus : le parallélisme vient du pool
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    _init_pdf_worker(pdf_bytes)
+    _worker_ocr = (cache_dir, dpi)
+
+
+def _ocr_result(page, cache_dir, dpi: int) -> tuple[str | None, str | None]:
+    """(texte OCR tronqué, None) ou (None, message) si l'OCR de la page échoue (OCR_PAGE_ERRORS)."""
+    try:
+        return _truncate_page(ocr_page(page, cache_dir, dpi)), None
+    except OCR_PAGE_ERRORS as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _ocr_page_text(page_no: int) -> tuple[str | None, str | None]:
+    return _ocr_result(_worker_doc[page_no], *_worker_ocr)
+
+
+def iter_cosmident_pages(pdf_bytes: bytes, workers: int | None = None, ocr: bool = False,
+                         ocr_cache=OCR_CACHE_DIR, dpi: int = OCR_DPI, on_ocr_error=None):
+    """
+    Texte tronqué de chaque page, dans l'ordre, au fil de la lecture de la couche texte.
+    Avec ocr, chaque page scannée part à l'OCR (pool de processus, une page par tâche)
+    dès qu'elle est lue : seules elle et les pages qui la suivent attendent son texte.
+    Une page dont l'OCR échoue (OCR_PAGE_ERRORS) garde sa couche texte et est signalée
+    par on_ocr_error(numéro de page, message) ; pytesseract absent lève ImportError.
+    """
+    if not ocr:
+        for text, _ in iter_text_layer(pdf_bytes, workers):
+            yield text
+        return
+    workers = PDF_WORKERS if workers is None else workers
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    pool = None
+    held = deque()  # (page, texte de la couche, OCR en cours ou None) derrière une page scannée
+
+    def ocr_job(page_no: int) -> Future:
+        nonlocal pool
+        if workers > 1:
+            try:
+                if pool is None:
+                    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_ocr_worker,
+                                               initargs=(pdf_bytes, ocr_cache, dpi))
+                return pool.submit(_ocr_page_text, page_no)
+            except (BrokenProcessPool, OSError, RuntimeError):
+                pass  # repli série
+        job = Future()
+        job.set_result(_ocr_result(doc[page_no], ocr_cache, dpi))
+        return job
+
+    def release(page_no: int, text: str, job: Future | None) -> str:
+        if job is None:
+            return text
+        try:
+            ocr_text, error = job.result()
+        except (BrokenProcessPool, OSError):  # pool perdu : la page est refaite ici
+            ocr_text, error = _ocr_result(doc[page_no], ocr_cache, dpi)
+        if error is not None:
+            if on_ocr_error is not None:
+                on_ocr_error(page_no, error)
+            return text
+        return ocr_text
+
+    try:
+        for page_no, (text, is_scan) in enumerate(iter_text_layer(pdf_bytes, workers)):
+            if not is_scan and not held:
+                yield text
+                continue
+            held.append((page_no, text, ocr_job(page_no) if is_scan else None))
+            while held and (held[0][2] is None or held[0][2].done()):
+                yield release(*held.popleft())
+        while held:
+            yield release(*held.popleft())
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+# Lexer : une ligne est classée une seule fois, expressions compilées au chargement
+_SKIP_LINE = re.compile(
+    r"teinte|couleur|A[1-3]|B[1-3]|C[1-3]|D[1-3]"
+    r"|COSMIDENT|IBAN|Siret|BIC|€|TOTAL TTC|CHÈQUE|NOS COORDONNÉES|BANCAIRES",
+    re.IGNORECASE,
+)
+_PATIENT_REF = re.compile(r"Ref\.?\s*(?:Patient\s*)?:?\s*([\w\s\-'’]+)", re.IGNORECASE)
+_AMOUNT_SPLIT = re.compile(r"\s*(\d+[\.,]\d{2})\s*")  # split : textes et montants alternés
+
+EV_PATIENT, EV_TEXT, EV_AMOUNT = 0, 1, 2
+
+
+def iter_cosmident_events(page_texts):
+    """
+    Événements typés, page par page : (EV_PATIENT, nom), (EV_TEXT, description),
+    (EV_AMOUNT, centimes). Lignes teinte / pied de page ignorées ; rien n'est
+    émis avant la première référence patient.
+    """
+    seen_patient = False
+    for page_text in page_texts:
+        for line in page_text.split("\n"):
+            line = line.strip()
+            if not line or _SKIP_LINE.search(line):
+                continue
+            ref = _PATIENT_REF.search(line)
+            if ref:
+                seen_patient = True
+                yield EV_PATIENT, ref.group(1).strip()
+                continue
+            if not seen_patient:
+                continue
+            parts = _AMOUNT_SPLIT.split(line)
+            if len(parts) == 1:
+                yield EV_TEXT, line
+                continue
+            text = " ".join(parts[0::2]).strip()
+            if text:
+                yield EV_TEXT, text
+            for amount in parts[1::2]:
+                yield EV_AMOUNT, int(amount[:-3] + amount[-2:])
+
+
+def iter_cosmident_rows(events):
+    """Machine à états sur les événements -> (patient, acte, prix en centimes) par acte."""
+    patient = ""
+    description = ""
+    total = None  # dernier montant de l'acte en cours
+    for kind, value in events:
+        if kind == EV_AMOUNT:
+            total = value
+        elif kind == EV_TEXT:
+            if description and total is not None:  # nouvelle description : l'acte en cours est clos
+                if total > 0:
+                    yield (patient, description, total)
+                description, total = value, None
+            else:
+                description = f"{description} {value}" if description else value
+        else:
+            if patient and description and total is not None and total > 0:
+                yield (patient, description, total)
+            patient, description, total = value, "", None
+    if patient and description and total is not None and total > 0:
+        yield (patient, description, total)
+
+
+def extract_data_from_cosmident(pdf_bytes: bytes, workers: int | None = None,
+                                preview_chars: int = 2000, ocr: bool = False,
+                                ocr_cache=OCR_CACHE_DIR, progress=None) -> tuple[pd.DataFrame, str]:
+    """
+    (lignes Cosmident, début du texte extrait pour l'aperçu).
+    Les pages sont parsées au fur et à mesure de leur extraction ; ocr=True
+    OCRise les pages scannées (cache disque ocr_cache, None pour le désactiver).
+    progress(pages=…, rows=…) est appelé à chaque page (lignes déjà extraites),
+    puis progress(warning=…) si l'OCR a échoué sur des pages (couche texte gardée).
+    """
+    preview = []
+    preview_len = 0
+    ocr_failed = []
+
+    def pages():
+        nonlocal preview_len
+        pages_iter = iter_cosmident_pages(pdf_bytes, workers, ocr=ocr, ocr_cache=ocr_cache,
+                                          on_ocr_error=lambda page_no, error: ocr_failed.append((page_no, error)))
+        for page_no, text in enumerate(pages_iter):
+            if preview_len < preview_chars:
+                preview.append(text + "\n")
+                preview_len += len(text) + 1
+            if progress is not None:
+                progress(pages=page_no + 1, rows=len(buf))
+            yield text
+
+    buf = ColumnBuffer(COSMIDENT_COLUMNS, COSMIDENT_INT_DTYPES)
+    for row in iter_cosmident_rows(iter_cosmident_events(pages())):
+        buf.append(row)
+    df = buf.frame() if len(buf) else pd.DataFrame()
+    if not df.empty:
+        df = df.drop_duplicates(subset=COSMIDENT_COLUMNS)
+    if ocr_failed and progress is not None:
+        numbers = ", ".join(str(page_no + 1) for page_no, _ in ocr_failed)
+        progress(warning=f"OCR en échec sur {len(ocr_failed)} page(s) scannée(s) (p. {numbers}), "
+                         f"couche texte gardée — {ocr_failed[0][1]}")
+    return df, "".join(preview)[:preview_chars]
+
+
+# ==================== 3) DESMOS (Excel) ====================
+DESMOS_COLUMNS = ["Patient", "Acte Desmos", "Prix Desmos"]
+DESMOS_PRICE_PATTERN = re.compile(r"(\d+(?:\.\d{1,2})?)")
+
+
+def desmos_columns(df: pd.DataFrame, pcol: str, acol: str, prcol: str) -> pd.DataFrame:
+    """Colonnes choisies renommées Patient / Acte Desmos / Prix Desmos (prix en centimes)."""
+    out = df[[pcol, acol, prcol]].copy()
+    out.columns = DESMOS_COLUMNS
+    out["Prix Desmos"] = to_cents(
+        out["Prix Desmos"].astype(str)
+        .str.replace(",", ".")
+        .str.extract(DESMOS_PRICE_PATTERN, expand=False)
+    )
+    out["Patient"] = out["Patient"].astype("category")
+    out["Acte Desmos"] = out["Acte Desmos"].astype("category")
+    return out
+
+
+# Lecture en deux temps : échantillon (en-tête + premières lignes) pour choisir
+# les colonnes, puis lecture des trois seules colonnes retenues
+DESMOS_SAMPLE_ROWS = 50
+DESMOS_LAYOUTS = "desmos_layouts.json"
+DESMOS_KEYWORDS = {
+    "Patient": ("patient", "nom", "ref", "name"),
+    "Acte Desmos": ("acte", "soin", "libelle", "description"),
+    "Prix Desmos": ("prix", "hono", "montant", "tarif"),
+}
+DESMOS_HEADER_WEIGHT = 2.0  # un mot-clé d'en-tête pèse plus que la forme des valeurs
+DESMOS_MIN_SCORE = 0.8      # sans mot-clé : 80 % des valeurs échantillonnées doivent avoir la bonne forme
+DESMOS_PRICE_CELL = re.compile(r"^-?\d[\d\s]*(?:[.,]\d{1,2})?\s*(?:€|eur)?$", re.IGNORECASE)
+DESMOS_NAME_CELL = re.compile(r"^[^\W\d_]+(?:[\s\-'’.]+[^\W\d_]+)+\.?$")
+
+
+def _header_names(row: tuple) -> list:
+    """Noms de colonnes comme pd.read_excel (Unnamed: i, doublons suffixés .1, .2…), espaces retirés."""
+    names, seen = [], {}
+    for i, v in enumerate(row):
+        name = f"Unnamed: {i}" if v is None or str(v).strip() == "" else str(v).strip()
+        n = seen.get(name, 0)
+        seen[name] = n + 1
+        names.append(f"{name}.{n}" if n else name)
+    return names
+
+
+def sample_desmos(file, xlsx: bool, n_rows: int = DESMOS_SAMPLE_ROWS) -> tuple[list, list, int]:
+    """(en-têtes, premières lignes, n° de la ligne d'en-tête) : première ligne non vide = en-tête."""
+    header, sample, header_row = None, [], 0
+    rows = iter_excel_rows(file, xlsx=xlsx)
+    try:
+        for r, row in enumerate(rows):
+            if header is None:
+                if any(v is not None for v in row):
+                    header, header_row = _header_names(row), r
+            else:
+                sample.append(row)
+                if len(sample) >= n_rows:
+                    break
+    finally:
+        rows.close()
+    header = header or []
+    sample = [tuple(row[:len(header)]) + (None,) * (len(header) - len(row)) for row in sample]
+    return header, sample, header_row
+
+
+def _fold(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text.lower()) if not unicodedata.combining(c))
+
+
+def _shape_scores(values: list) -> dict:
+    """Part des valeurs échantillonnées qui ont la forme d'un prix, d'un nom, d'un libellé d'acte."""
+    vals = [v for v in values if v is not None and not (isinstance(v, float) and v != v) and str(v).strip()]
+    if not vals:
+        return dict.fromkeys(DESMOS_COLUMNS, 0.0)
+    n = len(vals)
+    texts = [v.strip() for v in vals if isinstance(v, str)]
+    price = sum(1 for v in vals if (isinstance(v, (int, float)) and not isinstance(v, bool))
+                or (isinstance(v, str) and DESMOS_PRICE_CELL.match(v.strip()))) / n
+    name = sum(1 for t in texts if DESMOS_NAME_CELL.match(t)) / n
+    text = sum(1 for t in texts if any(c.isalpha() for c in t)) / n
+    distinct = len(set(map(str, vals))) / n  # patients variés, actes tirés d'un catalogue court
+    return {"Patient": name * (0.5 + 0.5 * distinct),
+            "Acte Desmos": text * (1.0 - 0.5 * distinct),
+            "Prix Desmos": price}
+
+
+def detect_desmos_columns(header: list, sample: list) -> dict | None:
+    """
+    {Patient / Acte Desmos / Prix Desmos: colonne} : mots-clés d'en-tête
+    (DESMOS_KEYWORDS, sans accents) + forme des valeurs de l'échantillon,
+    trois colonnes distinctes de meilleur score total (à égalité : la plus à
+    gauche). None si un rôle n'atteint pas DESMOS_MIN_SCORE.
+    """
+    if len(header) < 3:
+        return None
+    scores = {role: [] for role in DESMOS_COLUMNS}
+    for i, name in enumerate(header):
+        shape = _shape_scores([row[i] for row in sample])
+        folded = _fold(name)
+        for role, keywords in DESMOS_KEYWORDS.items():
+            hit = any(k in folded for k in keywords)
+            scores[role].append(DESMOS_HEADER_WEIGHT * hit + shape[role])
+    top = {role: sorted(range(len(header)), key=lambda i: -s[i])[:5] for role, s in scores.items()}
+    best, best_total = None, 0.0
+    for p in top["Patient"]:
+        for a in top["Acte Desmos"]:
+            for pr in top["Prix Desmos"]:
+                picked = (p, a, pr)
+                if len(set(picked)) < 3:
+                    continue
+                parts = [scores[role][i] for role, i in zip(DESMOS_COLUMNS, picked)]
+                total = sum(parts)
+                if min(parts) >= DESMOS_MIN_SCORE and (total > best_total
+                                                       or (total == best_total and picked < best)):
+                    best, best_total = picked, total
+    if best is None:
+        return None
+    return {role: header[i] for role, i in zip(DESMOS_COLUMNS, best)}
+
+
+class DesmosLayouts:
+    """Choix de colonnes Desmos mémorisés par disposition (liste des en-têtes), fichier JSON."""
+
+    def __init__(self, path=DESMOS_LAYOUTS):
+        self.path = path
+        self._layouts = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._layouts = json.load(f)
+
+    @staticmethod
+    def signature(header: list) -> str:
+        return hashlib.sha1("\x1f".join(header).encode("utf-8")).hexdigest()
+
+    def get(self, header: list) -> dict | None:
+        mapping = self._layouts.get(self.signature(header))
+        if mapping and all(mapping.get(role) in header for role in DESMOS_COLUMNS):
+            return {role: mapping[role] for role in DESMOS_COLUMNS}
+        return None
+
+    def remember(self, header: list, mapping: dict):
+        sig = self.signature(header)
+        if self._layouts.get(sig) == mapping:
+            return
+        self._layouts[sig] = dict(mapping)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._layouts, f, indent=1, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+def read_desmos_columns(file, xlsx: bool, header: list, mapping: dict, header_row: int = 0) -> pd.DataFrame:
+    """Lecture des trois colonnes choisies seulement (lignes vides ignorées), prix en centimes."""
+    positions = [header.index(mapping[role]) for role in DESMOS_COLUMNS]
+    values = ([], [], [])
+    rows = iter_excel_rows(file, xlsx=xlsx, columns=positions)
+    for r, row in enumerate(rows):
+        if r <= header_row or row == (None, None, None):
+            continue
+        for col, v in zip(values, row):
+            col.append(v)
+    df = pd.DataFrame({role: pd.Series(col, dtype=object) for role, col in zip(DESMOS_COLUMNS, values)})
+    return desmos_columns(df, *DESMOS_COLUMNS)
+
+
+def read_desmos_excel(file, xlsx: bool | None = None, layouts: DesmosLayouts | None = None,
+                      mapping: dict | None = None) -> pd.DataFrame:
+    """
+    Export Desmos ramené à Patient / Acte Desmos / Prix Desmos, en deux temps :
+    1. échantillon (en-tête + DESMOS_SAMPLE_ROWS lignes) : colonnes imposées
+       (mapping), mémorisées pour cette disposition (layouts) ou détectées ;
+    2. lecture des trois seules colonnes retenues.
+    Si la détection échoue, l'échantillon brut est rendu (choix manuel puis
+    read_desmos_excel(..., mapping=…)) ; un choix réussi est mémorisé dans layouts.
+    """
+    if xlsx is None:
+        xlsx = str(getattr(file, "name", "")).lower().endswith(".xlsx")
+    header, sample, header_row = sample_desmos(file, xlsx)
+    mapping = mapping or (layouts.get(header) if layouts is not None else None) \
+        or detect_desmos_columns(header, sample)
+    if mapping is None:
+        return pd.DataFrame(sample, columns=header)
+    if layouts is not None:
+        layouts.remember(header, mapping)
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return read_desmos_columns(file, xlsx, header, mapping, header_row)
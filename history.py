@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Historique multi-mois des clés patients (sans dépendance Streamlit) : store
+sur disque, complété mois par mois, relu en mémoire mappée.
+
+    store = IndexStore("historique")
+    store.add_month("Résultat", "2024-02", index_res)      # clés canoniques du mois
+    months = store.window("2024-02", 1)                    # ["2024-01", "2024-03"] si présents
+    index = store.window_index("Résultat", months)         # PatientIndex, sans re-parser
+
+Les signatures de blocage (tokens, longueurs, bigrammes) sont calculées une
+seule fois, à l'ajout du mois : un vocabulaire partagé (ids de tokens et de
+bigrammes stables) en fichiers binaires bruts en ajout seul, et par source
+et par mois un segment (clés, nombre de tokens, ids de tokens). Rien n'est
+réécrit quand un mois s'ajoute ; les tableaux sont ouverts par np.memmap et
+le manifeste (écrit en dernier, remplacement atomique) fait foi des tailles.
+
+Les valeurs de l'index fenêtre sont les mois où la clé apparaît (pas de
+lignes) : il sert au passage des orphelins Cosmident (cosmident_orphans,
+window_indexes), pas à match_result_rows.
+
+    python history.py historique list
+"""
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from matching import PatientIndex, _bigrams, _csr, canonical_tokens
+
+HISTORY_DIR = "historique"
+HISTORY_WINDOW = 1          # mois voisins de chaque côté
+HISTORY_SOURCES = ("Résultat", "Desmos", "Cosmident")
+STORE_VERSION = 1
+
+# fichiers du vocabulaire partagé : (nom, dtype) des tableaux en ajout seul
+_VOCAB_ARRAYS = {"tok_len": np.int16, "tok_ngrams": np.int16, "tok_grams": np.int32}
+
+
+def _memmap(path: Path, dtype, count: int) -> np.ndarray:
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+def _read_lines(path: Path, count: int) -> list:
+    if count == 0:
+        return []
+    with open(path, encoding="utf-8") as f:
+        return f.read().split("\n")[:count]
+
+
+def _truncate(path: Path, size: int):
+    """Coupe une fin de fichier non validée par le manifeste (ajout interrompu)."""
+    if path.exists() and path.stat().st_size > size:
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+class Vocabulary:
+    """Tokens et bigrammes connus du store (ids stables), index bigramme -> tokens dérivé à l'ouverture."""
+
+    def __init__(self, tokens: list, grams: list, tok_len: np.ndarray, tok_ngrams: np.ndarray,
+                 tok_grams: np.ndarray):
+        self.tokens = tokens
+        self.tok_ids = {t: i for i, t in enumerate(tokens)}
+        self.grams = grams
+        self.gram_ids = {g: i for i, g in enumerate(grams)}
+        self.tok_len = tok_len
+        self.tok_ngrams = tok_ngrams
+        self.tok_grams = tok_grams
+        tok_of = np.repeat(np.arange(len(tokens), dtype=np.int32), tok_ngrams)
+        self.gram_off, self.gram_toks = _csr(np.asarray(tok_grams, dtype=np.int32), tok_of, len(grams))
+
+
+class IndexStore:
+    def __init__(self, folder=HISTORY_DIR):
+        self.folder = Path(folder)
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self._manifest_path = self.folder / "manifest.json"
+        if self._manifest_path.exists():
+            self.manifest = json.loads(self._manifest_path.read_text(encoding="utf-8"))
+            if self.manifest.get("version") != STORE_VERSION:
+                raise ValueError(f"{self.folder} : historique version {self.manifest.get('version')}, "
+                                 f"attendu {STORE_VERSION}")
+        else:
+            self.manifest = {"version": STORE_VERSION, "tokens": 0, "grams": 0, "tok_grams": 0, "segments": {}}
+        self._recover()
+        self._vocab = None
+
+    # ---------- fichiers ----------
+    def _path(self, name: str) -> Path:
+        return self.folder / name
+
+    def _segment_paths(self, source: str, month: str) -> tuple[Path, Path, Path]:
+        base = self.folder / source
+        return base / f"{month}.keys", base / f"{month}.len.i16", base / f"{month}.tok.i32"
+
+    def _text_size(self, name: str, count: int) -> int:
+        lines = _read_lines(self._path(name), count)
+        return sum(len(line.encode("utf-8")) + 1 for line in lines)
+
+    def _recover(self):
+        m = self.manifest
+        _truncate(self._path("tokens.txt"), self._text_size("tokens.txt", m["tokens"]))
+        _truncate(self._path("grams.txt"), self._text_size("grams.txt", m["grams"]))
+        _truncate(self._path("tok_len.i16"), 2 * m["tokens"])
+        _truncate(self._path("tok_ngrams.i16"), 2 * m["tokens"])
+        _truncate(self._path("tok_grams.i32"), 4 * m["tok_grams"])
+
+    def _write_manifest(self):
+        tmp = self._manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=1, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._manifest_path)
+
+    # ---------- vocabulaire ----------
+    def vocabulary(self) -> Vocabulary:
+        if self._vocab is None:
+            m = self.manifest
+            self._vocab = Vocabulary(
+                _read_lines(self._path("tokens.txt"), m["tokens"]),
+                _read_lines(self._path("grams.txt"), m["grams"]),
+                _memmap(self._path("tok_len.i16"), np.int16, m["tokens"]),
+                _memmap(self._path("tok_ngrams.i16"), np.int16, m["tokens"]),
+                _memmap(self._path("tok_grams.i32"), np.int32, m["tok_grams"]),
+            )
+        return self._vocab
+
+    def _token_ids(self, keys: list) -> tuple[np.ndarray, np.ndarray]:
+        """(nombre de tokens par clé, ids à plat) ; tokens et bigrammes nouveaux ajoutés en fin de fichiers."""
+        vocab = self.vocabulary()
+        tok_ids, gram_ids = dict(vocab.tok_ids), dict(vocab.gram_ids)
+        new_tokens, new_grams, new_len, new_ngrams, new_tok_grams = [], [], [], [], []
+        key_len, key_tok = [], []
+        for key in keys:
+            toks = canonical_tokens(key)
+            key_len.append(len(toks))
+            for t in toks:
+                tid = tok_ids.get(t)
+                if tid is None:
+                    tid = tok_ids[t] = len(tok_ids)
+                    grams = _bigrams(t)
+                    new_tokens.append(t)
+                    new_len.append(len(t))
+                    new_ngrams.append(len(grams))
+                    for g in grams:
+                        if g not in gram_ids:
+                            gram_ids[g] = len(gram_ids)
+                            new_grams.append(g)
+                        new_tok_grams.append(gram_ids[g])
+                key_tok.append(tid)
+        if new_tokens:
+            with open(self._path("tokens.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(t + "\n" for t in new_tokens))
+            with open(self._path("grams.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(g + "\n" for g in new_grams))
+            for name, values in (("tok_len", new_len), ("tok_ngrams", new_ngrams), ("tok_grams", new_tok_grams)):
+                ext = "i16" if _VOCAB_ARRAYS[name] is np.int16 else "i32"
+                with open(self._path(f"{name}.{ext}"), "ab") as f:
+                    f.write(np.array(values, dtype=_VOCAB_ARRAYS[name]).tobytes())
+            self.manifest["tokens"] += len(new_tokens)
+            self.manifest["grams"] += len(new_grams)
+            self.manifest["tok_grams"] += len(new_tok_grams)
+            self._vocab = None
+        return np.array(key_len, dtype=np.int16), np.array(key_tok, dtype=np.int32)
+
+    # ---------- segments mensuels ----------
+    def months(self, source: str | None = None) -> list:
+        segments = self.manifest["segments"]
+        if source is not None:
+            return sorted(segments.get(source, {}))
+        return sorted({m for per_month in segments.values() for m in per_month})
+
+    def add_month(self, source: str, month: str, keys) -> int:
+        """
+        Enregistre les clés canoniques du mois pour la source (remplace le mois
+        s'il existe déjà) ; rend le nombre de clés. `keys` : un index (ses clés)
+        ou un itérable de clés canoniques.
+        """
+        keys = [k for k in dict.fromkeys(keys) if k]
+        key_len, key_tok = self._token_ids(keys)
+        p_keys, p_len, p_tok = self._segment_paths(source, month)
+        p_keys.parent.mkdir(parents=True, exist_ok=True)
+        p_keys.write_text("".join(k + "\n" for k in keys), encoding="utf-8")
+        p_len.write_bytes(key_len.tobytes())
+        p_tok.write_bytes(key_tok.tobytes())
+        self.manifest["segments"].setdefault(source, {})[month] = {"keys": len(keys), "tokens": len(key_tok)}
+        self._write_manifest()
+        return len(keys)
+
+    def window(self, month: str, size: int = HISTORY_WINDOW) -> list:
+        """Mois enregistrés voisins de `month` (size de chaque côté, dans l'ordre des noms), month exclu."""
+        months = self.months()
+        if month not in months:
+            months = sorted(months + [month])
+        i = months.index(month)
+        return months[max(0, i - size):i] + months[i + 1:i + 1 + size]
+
+    def window_index(self, source: str, months) -> PatientIndex:
+        """Index des clés de la source sur ces mois (première occurrence : ordre des mois), valeurs = mois."""
+        entries = {}
+        lens, toks = [], []
+        for month in months:
+            seg = self.manifest["segments"].get(source, {}).get(month)
+            if seg is None:
+                continue
+            p_keys, p_len, p_tok = self._segment_paths(source, month)
+            keys = _read_lines(p_keys, seg["keys"])
+            key_len = _memmap(p_len, np.int16, seg["keys"])
+            key_tok = _memmap(p_tok, np.int32, seg["tokens"])
+            off = np.zeros(len(keys) + 1, dtype=np.int64)
+            np.cumsum(key_len, out=off[1:])
+            new = np.zeros(len(keys), dtype=bool)
+            for i, key in enumerate(keys):
+                if key in entries:
+                    entries[key].append(month)
+                else:
+                    entries[key] = [month]
+                    new[i] = True
+            lens.append(key_len[new])
+            toks.append(key_tok[np.repeat(new, key_len)])
+        if not entries:
+            return PatientIndex()
+        return PatientIndex.from_signatures(entries, np.concatenate(lens), np.concatenate(toks), self.vocabulary())
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Historique multi-mois des clés patients.")
+    parser.add_argument("folder", type=Path)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    args = parser.parse_args(argv)
+
+    store = IndexStore(args.folder)
+    m = store.manifest
+    print(f"{m['tokens']} tokens, {m['grams']} bigrammes")
+    for source in HISTORY_SOURCES:
+        for month in store.months(source):
+            print(f"{source:<10} {month}  {m['segments'][source][month]['keys']} clés")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Ingestion concurrente des fichiers (sans dépendance Streamlit) : facturation,
+Cosmident et Desmos sont parsés en même temps dans un pool de threads, et
+chaque source construit son index patient dès que sa frame est prête. Le
+temps d'attente est celui du parseur le plus lent, pas la somme.
+
+    ingest = Ingestion()
+    ingest.submit("cosmident", parse_cos, index=build_index)
+    for task in ingest.as_completed(on_tick=refresh):
+        ...                  # affichage de la source dès qu'elle est prête
+
+Un parseur reçoit sa tâche et publie son avancement (task.update(rows=…,
+pages=…)) ; le thread appelant le lit à chaque tick. Threads plutôt que
+processus : frames et index restent dans le processus (caches compris),
+et l'extraction PDF a déjà son propre pool de processus.
+"""
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+INGEST_WORKERS = 3   # une source par thread
+INGEST_TICK = 0.2    # secondes entre deux rafraîchissements de l'avancement
+
+STATE_PENDING = "en attente"
+STATE_PARSING = "lecture"
+STATE_INDEXING = "index"
+STATE_READY = "prêt"
+STATE_FAILED = "erreur"
+
+
+def count_rows(items, progress, every: int = 500):
+    """Relaie un itérable de lignes en publiant leur nombre (progress(rows=…)) toutes les `every` lignes."""
+    n = 0
+    for n, item in enumerate(items, 1):
+        if n % every == 0:
+            progress(rows=n)
+        yield item
+    progress(rows=n)
+
+
+class IngestTask:
+    def __init__(self, name: str):
+        self.name = name
+        self.state = STATE_PENDING
+        self.rows = 0
+        self.pages = 0
+        self.seconds = 0.0
+        self.frame = None
+        self.index = None
+        self.extra = None   # sortie annexe du parseur (aperçu du texte PDF…)
+        self.warnings = []  # avertissements du parseur, affichés avec la source
+        self.error = None
+        self._t0 = None
+
+    def update(self, rows: int | None = None, pages: int | None = None):
+        """Appelé par le parseur (thread de travail) au fil de la lecture."""
+        if rows is not None:
+            self.rows = rows
+        if pages is not None:
+            self.pages = pages
+
+    @property
+    def done(self) -> bool:
+        return self.state in (STATE_READY, STATE_FAILED)
+
+    @property
+    def elapsed(self) -> float:
+        if self.done or self._t0 is None:
+            return self.seconds
+        return time.perf_counter() - self._t0
+
+    def run(self, parse, index=None):
+        self._t0 = time.perf_counter()
+        self.state = STATE_PARSING
+        try:
+            self.frame = parse(self)
+            self.rows = len(self.frame)
+            if index is not None and not self.frame.empty:
+                self.state = STATE_INDEXING
+                self.index = index(self.frame)
+            self.state = STATE_READY
+        except Exception as e:
+            self.error = e
+            self.state = STATE_FAILED
+        finally:
+            self.seconds = time.perf_counter() - self._t0
+        return self
+
+
+class Ingestion:
+    def __init__(self, max_workers: int = INGEST_WORKERS, initializer=None, initargs=()):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion",
+                                        initializer=initializer, initargs=initargs)
+        self._futures = {}
+        self.tasks = {}
+
+    def submit(self, name: str, parse, index=None) -> IngestTask:
+        """parse(task) -> DataFrame ; index(frame) -> index patient, construit dans le même thread."""
+        task = IngestTask(name)
+        self.tasks[name] = task
+        self._futures[self._pool.submit(task.run, parse, index)] = task
+        return task
+
+    def as_completed(self, on_tick=None, tick: float = INGEST_TICK):
+        """Tâches dans leur ordre de fin ; on_tick(tasks) appelé entre deux attentes (avancement)."""
+        pending = set(self._futures)
+        while pending:
+            done, pending = wait(pending, timeout=tick, return_when=FIRST_COMPLETED)
+            if on_tick is not None:
+                on_tick(self.tasks)
+            for future in done:
+                yield self._futures[future]
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
@@ -0,0 +1,795 @@
+# -*- coding: utf-8 -*-
+"""
+Utilitaires de matching des noms patients (sans dépendance Streamlit).
+
+La tolérance aux fautes (`tol`) est passée explicitement : l'app la lit
+dans la barre latérale, les scripts (bench, batch) peuvent la fixer eux-mêmes.
+"""
+import os
+import re
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from itertools import repeat
+
+import numpy as np
+import pandas as pd
+
+# Valeurs par défaut (identiques aux curseurs de la barre latérale)
+FUZZY_REL_ERR = 0.20
+SCORE_THRESHOLD = 0.50
+
+# Caches LRU bornés (noms canonisés, comparaisons de tokens)
+NAME_CACHE_SIZE = 1 << 16
+PAIR_CACHE_SIZE = 1 << 18
+
+# Scoring parallèle des clés cibles (cf. PatientIndex.rank_many)
+MATCH_WORKERS = os.cpu_count() or 1
+MATCH_CHUNK_SIZE = 256
+MATCH_PARALLEL_MIN_KEYS = 2000  # en dessous, le démarrage du pool coûte plus qu'il ne rapporte
+
+# Compteurs d'appels (diagnostics, cf. profiling.Profiler.counting) : comptés
+# seulement si COUNT_CALLS, dans ce processus (pas dans les workers de rank_many)
+COUNTED_FUNCTIONS = ("levenshtein", "levenshtein_within", "fuzzy_equal", "names_match_permissive")
+COUNT_CALLS = False
+CALLS = Counter()
+
+# ==================== UTILITAIRES NOM (ULTRA-PERMISSIF, corrigés) ====================
+COMMON_WORDS = {
+    "de","du","des","la","le","les","d","l","mr","mme","m","monsieur","madame"
+}
+
+def strip_accents(s: str) -> str:
+    return _strip_accents(str(s))
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _strip_accents(s: str) -> str:
+    s_norm = unicodedata.normalize("NFD", s)
+    s_no = "".join(ch for ch in s_norm if unicodedata.category(ch) != "Mn")
+    s_clean = re.sub(r"[^a-zA-Z\s\-']", " ", s_no)
+    s_clean = re.sub(r"\s+", " ", s_clean).strip().lower()
+    return s_clean
+
+def canonical_tokens(name: str) -> list:
+    return list(_canonical_tokens(str(name)))
+
+@lru_cache(maxsize=NAME_CACHE_SIZE)
+def _canonical_tokens(name: str) -> tuple:
+    raw = _strip_accents(name)
+    toks = []
+    for t in re.split(r"[ \-]+", raw):
+        t = t.strip()
+        if not t or len(t) < 2:
+            continue
+        if t in COMMON_WORDS:
+            continue
+        toks.append(t)
+    return tuple(sorted(toks))  # tri pour ignorer inversion nom/prénom
+
+def levenshtein(a: str, b: str) -> int:
+    """Distance d’édition (programmation dynamique, une ligne mémoire)."""
+    if COUNT_CALLS:
+        CALLS["levenshtein"] += 1
+    if a == b:
+        return 0
+    n, m = len(a), len(b)
+    if n == 0:
+        return m
+    if m == 0:
+        return n
+    prev_row = list(range(m + 1))
+    for i, ca in enumerate(a, 1):
+        curr = [i]
+        for j, cb in enumerate(b, 1):
+            insert_cost = curr[j - 1] + 1
+            delete_cost = prev_row[j] + 1
+            subst_cost  = prev_row[j - 1] + (0 if ca == cb else 1)
+            curr.append(min(insert_cost, delete_cost, subst_cost))
+        prev_row = curr
+    return prev_row[-1]
+
+# ==================== DISTANCE BORNÉE (arrêt anticipé) ====================
+MYERS_MAX_LEN = 64  # au-delà : DP en bande
+
+def max_edits(L: int, tol: float) -> int:
+    """
+    Plus grand k tel que k / L <= tol (même comparaison flottante que
+    l'ancien test `levenshtein(a, b) / L <= tol`).
+    """
+    k = int(tol * L)
+    while (k + 1) / L <= tol:
+        k += 1
+    while k >= 0 and k / L > tol:
+        k -= 1
+    return k
+
+def _myers_within(a: str, b: str, k: int) -> bool:
+    """
+    Levenshtein bit-parallèle (Myers / Hyyrö), `a` = motif (len(a) < 64).
+    Arrêt dès que la distance finale ne peut plus descendre sous k.
+    """
+    m = len(a)
+    peq = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = mask, 0, m
+    remaining = len(b)
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        remaining -= 1
+        # chaque caractère restant fait baisser la distance d'au plus 1
+        if score - remaining > k:
+            return False
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & mask
+        mv = ph & xv
+    return score <= k
+
+def _banded_within(a: str, b: str, k: int) -> bool:
+    """DP d'Ukkonen limitée à la bande |i - j| <= k, arrêt si la ligne dépasse k."""
+    n, m = len(a), len(b)
+    big = k + 1
+    prev = [j if j <= k else big for j in range(m + 1)]
+    for i in range(1, n + 1):
+        lo = max(1, i - k)
+        hi = min(m, i + k)
+        curr = [big] * (m + 1)
+        if i <= k:
+            curr[0] = i
+        ca = a[i - 1]
+        row_min = curr[0]
+        for j in range(lo, hi + 1):
+            v = prev[j - 1] + (0 if ca == b[j - 1] else 1)
+            if prev[j] + 1 < v:
+                v = prev[j] + 1
+            if curr[j - 1] + 1 < v:
+                v = curr[j - 1] + 1
+            if v > big:
+                v = big
+            curr[j] = v
+            if v < row_min:
+                row_min = v
+        if row_min > k:
+            return False
+        prev = curr
+    return prev[m] <= k
+
+def levenshtein_within(a: str, b: str, k: int) -> bool:
+    """True si levenshtein(a, b) <= k, sans calculer la matrice complète."""
+    if COUNT_CALLS:
+        CALLS["levenshtein_within"] += 1
+    if k < 0:
+        return False
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > k:  # la distance est au moins l'écart de longueur
+        return False
+    if la > lb:
+        a, b, la, lb = b, a, lb, la
+    if la == 0:
+        return lb <= k
+    if k == 0:
+        return False
+    if la < MYERS_MAX_LEN:
+        return _myers_within(a, b, k)
+    return _banded_within(a, b, k)
+
+def fuzzy_equal(a: str, b: str, tol: float = FUZZY_REL_ERR) -> bool:
+    """
+    Tolère petites fautes: distance d'édition <= tol * longueur max.
+    """
+    if COUNT_CALLS:
+        CALLS["fuzzy_equal"] += 1
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    if b < a:  # symétrique : une seule entrée de cache par paire
+        a, b = b, a
+    return _fuzzy_equal(a, b, tol)
+
+@lru_cache(maxsize=PAIR_CACHE_SIZE)
+def _fuzzy_equal(a: str, b: str, tol: float) -> bool:
+    # la tolérance fait partie de la clé : un changement de curseur ne relit pas d'anciens résultats
+    L = max(len(a), len(b))
+    return levenshtein_within(a, b, max_edits(L, tol))
+
+def cache_stats() -> dict:
+    """Compteurs hits / misses des caches (affichés dans la barre latérale)."""
+    out = {}
+    for label, fn in (("Noms canonisés", _canonical_tokens),
+                      ("Accents retirés", _strip_accents),
+                      ("Paires de tokens", _fuzzy_equal),
+                      ("Couplages de noms", _match_tokens_count)):
+        info = fn.cache_info()
+        out[label] = {"hits": info.hits, "misses": info.misses,
+                      "taille": info.currsize, "max": info.maxsize}
+    return out
+
+def clear_caches():
+    _canonical_tokens.cache_clear()
+    _strip_accents.cache_clear()
+    _fuzzy_equal.cache_clear()
+    _match_tokens_count.cache_clear()
+
+def match_tokens_count(ta: list, tb: list, tol: float = FUZZY_REL_ERR) -> int:
+    """
+    Nombre maximal de paires (a, b) exactes ou fuzzy-égales, chaque token de B
+    servant au plus une fois (couplage biparti maximum).
+    Greedy d'abord, sans cache ni copie : il est optimal s'il couple tous les
+    tokens du plus petit nom, ou si aucun token de A resté seul n'a d'équivalent
+    (ses équivalents sont forcément déjà pris : sans équivalent, pas de chemin
+    augmentant). Sinon seulement, couplage exact (_match_tokens_count, en cache).
+    """
+    used_b = 0
+    alone = []
+    for a in ta:
+        for j, b in enumerate(tb):
+            if not used_b >> j & 1 and (a == b or fuzzy_equal(a, b, tol)):
+                used_b |= 1 << j
+                break
+        else:
+            alone.append(a)
+    k = used_b.bit_count()
+    if k == min(len(ta), len(tb)):
+        return k
+    for a in alone:
+        la = len(a)
+        for j, b in enumerate(tb):
+            # l'écart de longueur minore la distance d'édition : rejet sans appel
+            if used_b >> j & 1 and (a == b or a and b and abs(la - len(b))
+                                    <= max_edits(max(la, len(b)), tol) and fuzzy_equal(a, b, tol)):
+                return _match_tokens_count(tuple(ta), tuple(tb), tol)
+    return k
+
+@lru_cache(maxsize=PAIR_CACHE_SIZE)
+def _match_tokens_count(ta: tuple, tb: tuple, tol: float) -> int:
+    # matrice de similarité : une ligne par token de A, bit j = token j de B équivalent
+    rows = [sum(1 << j for j, b in enumerate(tb) if a == b or fuzzy_equal(a, b, tol)) for a in ta]
+    owner = {}  # colonne de B -> ligne de A couplée
+
+    def augment(i: int, seen: list) -> bool:
+        # chemin augmentant (Kuhn) : une colonne libre, ou une colonne dont le
+        # propriétaire peut se reporter ailleurs ; seen[0] = colonnes déjà visitées
+        free = rows[i] & ~seen[0]
+        while free:
+            low = free & -free
+            seen[0] |= low
+            j = low.bit_length() - 1
+            if j not in owner or augment(owner[j], seen):
+                owner[j] = i
+                return True
+            free = rows[i] & ~seen[0]
+        return False
+
+    return sum(1 for i, r in enumerate(rows) if r and augment(i, [0]))
+
+def core_tokens(tokens: list, n: int = 2) -> list:
+    return sorted(tokens, key=len, reverse=True)[:n]
+
+def names_match_permissive(name_a: str, name_b: str, tol: float = FUZZY_REL_ERR) -> tuple[bool, float]:
+    """
+    (match_bool, score) — règles permissives :
+    - couverture k / min(lenA, lenB) >= 0.66
+    - OU k >= 2
+    - OU les 2 tokens cœur d’un nom sont présents dans l’autre (exact ou fuzzy)
+    Score = 0.6 * couverture + 0.4 * jaccard + 0.15 * core_bonus
+    """
+    if COUNT_CALLS:
+        CALLS["names_match_permissive"] += 1
+    ta = canonical_tokens(name_a)
+    tb = canonical_tokens(name_b)
+    if not ta or not tb:
+        return (False, 0.0)
+
+    if set(ta) == set(tb):
+        return (True, 1.0)
+
+    k = match_tokens_count(ta, tb, tol)
+    minlen = min(len(ta), len(tb)) or 1
+    union = len(set(ta) | set(tb)) or 1
+    coverage = k / minlen
+    jacc = k / union
+
+    ca = core_tokens(ta, 2)
+    cb = core_tokens(tb, 2)
+
+    def core_hit(cside, other):
+        hits = 0
+        for c in cside:
+            if any(c == o or fuzzy_equal(c, o, tol) for o in other):
+                hits += 1
+        return hits >= 2
+
+    core_bonus = 1.0 if (core_hit(ca, tb) or core_hit(cb, ta)) else 0.0
+    score = 0.6 * coverage + 0.4 * jacc + 0.15 * core_bonus
+    match = (coverage >= 0.66) or (k >= 2) or (core_bonus > 0.0)
+
+    return (match, score)
+
+# ==================== INDEX DE CANDIDATS (blocage par tokens) ====================
+SCORE_TOP_K = 5            # candidats gardés par clé cible
+SCORE_TOLERANCES_KEPT = 4  # matrices de scores gardées (une par tolérance)
+
+def _bigrams(token: str) -> set:
+    return {token[i:i + 2] for i in range(len(token) - 1)}
+
+def _csr(groups: np.ndarray, values: np.ndarray, n_groups: int) -> tuple[np.ndarray, np.ndarray]:
+    """(offsets, valeurs triées par groupe) : valeurs du groupe g = data[off[g]:off[g + 1]]."""
+    order = np.argsort(groups, kind="stable")
+    off = np.zeros(n_groups + 1, dtype=np.int32)
+    np.cumsum(np.bincount(groups, minlength=n_groups), out=off[1:])
+    return off, values[order].astype(np.int32)
+
+def _gather(off: np.ndarray, data: np.ndarray, ids) -> np.ndarray:
+    parts = [data[off[i]:off[i + 1]] for i in ids]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+
+
+class PatientIndex(dict):
+    """
+    Index clé canonique -> lignes (comme avant), enrichi d'un index de blocage
+    construit une fois, en tableaux numpy compacts (CSR) :
+    - tokens distincts (id), leur longueur et leurs bigrammes distincts ;
+    - bigramme -> ids de tokens, token -> positions des clés (index inversés) ;
+    - clé -> ids de ses tokens.
+
+    Recherche des tokens fuzzy-égaux à un token : filtre de longueur et de
+    bigrammes communs (k éditions détruisent au plus 2k bigrammes distincts),
+    vectorisé sur tous les tokens, puis fuzzy_equal sur les survivants
+    seulement. Le filtre est exact : mêmes tokens que la comparaison complète.
+
+    Une clé candidate doit partager au moins un token fuzzy-égal avec la cible ;
+    elle n'est scorée que si elle peut encore matcher : k >= 2 ou cœur commun
+    demandent 2 tokens d'un côté avec un équivalent de l'autre, la couverture
+    seule ne suffit qu'avec un nom d'un token. Un prénom courant partagé ne
+    suffit donc plus à déclencher names_match_permissive. Les candidats sont
+    scorés dans l'ordre d'insertion (mêmes égalités de score → même gagnant
+    que le balayage complet).
+
+    Les scores calculés sont conservés (top-k par clé cible, par tolérance) :
+    ils ne dépendent pas du seuil, qui ne fait que filtrer le meilleur.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._keys = []
+        self._tokens = None
+        self._scores = {}   # tol -> {clé cible: [(clé candidate, score), ...]}
+        self._similar = {}  # tol -> {token: ids des tokens fuzzy-égaux}
+        self._edits = {}    # tol -> max_edits(L, tol) pour L = 0..longueur max
+
+    def _build(self):
+        self._keys = list(self.keys())
+        tok_ids = {}
+        key_tok = []
+        key_len = []
+        for key in self._keys:
+            toks = canonical_tokens(key)
+            key_tok.extend(tok_ids.setdefault(t, len(tok_ids)) for t in toks)
+            key_len.append(len(toks))
+        self._tokens = list(tok_ids)
+        self._tok_ids = tok_ids
+        n_keys, n_tok = len(self._keys), len(self._tokens)
+
+        self._key_len = np.array(key_len, dtype=np.int16)
+        key_tok = np.array(key_tok, dtype=np.int32)
+        key_of = np.repeat(np.arange(n_keys, dtype=np.int32), self._key_len)
+        # token -> positions des clés (une entrée par occurrence dans la clé)
+        self._post_off, self._post_keys = _csr(key_tok, key_of, n_tok)
+
+        gram_ids = {}
+        gram_tok = []
+        gram_of = []
+        self._tok_len = np.array([len(t) for t in self._tokens], dtype=np.int16)
+        self._tok_ngrams = np.zeros(n_tok, dtype=np.int16)
+        for tid, tok in enumerate(self._tokens):
+            grams = _bigrams(tok)
+            self._tok_ngrams[tid] = len(grams)
+            for g in grams:
+                gram_of.append(gram_ids.setdefault(g, len(gram_ids)))
+                gram_tok.append(tid)
+        self._gram_ids = gram_ids
+        self._gram_off, self._gram_toks = _csr(np.array(gram_of, dtype=np.int32),
+                                               np.array(gram_tok, dtype=np.int32), len(gram_ids))
+
+    @classmethod
+    def from_signatures(cls, entries: dict, key_len: np.ndarray, key_tok: np.ndarray, vocab) -> "PatientIndex":
+        """
+        Index reconstruit depuis des signatures déjà calculées (cf. history.IndexStore),
+        sans recanoniser les clés ni recalculer les bigrammes : entries {clé: valeur}
+        dans l'ordre d'insertion, key_len / key_tok (ids de tokens de la clé, à plat)
+        relatifs au vocabulaire partagé vocab (tokens, tok_ids, tok_len, tok_ngrams,
+        gram_ids, gram_off, gram_toks). Mêmes candidats et scores que _build.
+        """
+        idx = cls()
+        dict.update(idx, entries)
+        idx._keys = list(entries)
+        idx._tokens = vocab.tokens
+        idx._tok_ids = vocab.tok_ids
+        idx._key_len = np.asarray(key_len, dtype=np.int16)
+        key_of = np.repeat(np.arange(len(idx._keys), dtype=np.int32), idx._key_len)
+        idx._post_off, idx._post_keys = _csr(np.asarray(key_tok, dtype=np.int32), key_of, len(vocab.tokens))
+        idx._tok_len = vocab.tok_len
+        idx._tok_ngrams = vocab.tok_ngrams
+        idx._gram_ids = vocab.gram_ids
+        idx._gram_off, idx._gram_toks = vocab.gram_off, vocab.gram_toks
+        return idx
+
+    def prepare(self) -> "PatientIndex":
+        """Construit tout de suite l'index de blocage (sinon : à la première requête)."""
+        if self._tokens is None:
+            self._build()
+        return self
+
+    def _per_tol(self, cache: dict, tol: float) -> dict:
+        per_tol = cache.get(tol)
+        if per_tol is None:
+            while len(cache) >= SCORE_TOLERANCES_KEPT:
+                cache.pop(next(iter(cache)), None)
+            per_tol = cache[tol] = {}
+        return per_tol
+
+    def _edits_table(self, tol: float, max_len: int) -> np.ndarray:
+        table = self._edits.get(tol)
+        if table is None or len(table) <= max_len:
+            table = np.array([0] + [max_edits(L, tol) for L in range(1, max_len + 1)], dtype=np.int16)
+            self._edits[tol] = table
+        return table
+
+    def _similar_ids(self, token: str, tol: float) -> np.ndarray:
+        per_tol = self._per_tol(self._similar, tol)
+        ids = per_tol.get(token)
+        if ids is not None:
+            return ids
+        if not self._tokens:
+            ids = per_tol[token] = np.empty(0, dtype=np.int32)
+            return ids
+        la = len(token)
+        grams = [self._gram_ids[g] for g in _bigrams(token) if g in self._gram_ids]
+        shared = np.bincount(_gather(self._gram_off, self._gram_toks, grams), minlength=len(self._tokens))
+        L = np.maximum(self._tok_len, la)
+        k = self._edits_table(tol, max(la, int(self._tok_len.max())))[L]
+        ok = ((np.abs(self._tok_len - la) <= k)
+              & (shared >= len(_bigrams(token)) - 2 * k)
+              & (shared >= self._tok_ngrams - 2 * k))
+        ids = np.array([t for t in np.flatnonzero(ok) if fuzzy_equal(token, self._tokens[t], tol)], dtype=np.int32)
+        per_tol[token] = ids
+        return ids
+
+    def similar_tokens(self, token: str, tol: float = FUZZY_REL_ERR) -> list:
+        """Tokens de l'index tels que fuzzy_equal(token, t, tol)."""
+        if self._tokens is None:
+            self._build()
+        return [self._tokens[t] for t in self._similar_ids(token, tol)]
+
+    def candidate_keys(self, target_key: str, tol: float = FUZZY_REL_ERR) -> list:
+        """Clés qui peuvent matcher target_key (cf. docstring de la classe), ordre d'insertion."""
+        if self._tokens is None:
+            self._build()
+        ta = canonical_tokens(target_key)
+        n_keys = len(self._keys)
+        hit_a = np.zeros(n_keys, dtype=np.int16)  # tokens de la cible avec un équivalent dans la clé
+        union = []
+        for tok in ta:
+            sims = self._similar_ids(tok, tol)
+            if len(sims):
+                hit_a[np.unique(_gather(self._post_off, self._post_keys, sims))] += 1
+                union.append(sims)
+        if not union:
+            return []
+        # tokens de la clé avec un équivalent dans la cible
+        hit_b = np.bincount(_gather(self._post_off, self._post_keys, np.unique(np.concatenate(union))),
+                            minlength=n_keys)
+        keep = (hit_a > 0) & ((hit_a >= 2) | (hit_b >= 2) | (np.minimum(self._key_len, len(ta)) == 1))
+        return [self._keys[p] for p in np.flatnonzero(keep)]
+
+    def ranked_candidates(self, target_key: str, tol: float = FUZZY_REL_ERR) -> list:
+        """
+        [(clé, score)] des candidats qui matchent, meilleur d'abord (à score égal :
+        ordre d'insertion), limité à SCORE_TOP_K. Calculé une fois par tolérance.
+        """
+        per_tol = self._per_tol(self._scores, tol)
+        ranked = per_tol.get(target_key)
+        if ranked is None:
+            ranked = []
+            for cand_key in self.candidate_keys(target_key, tol):
+                match, score = names_match_permissive(target_key, cand_key, tol)
+                if match:
+                    ranked.append((cand_key, score))
+            ranked.sort(key=lambda ks: -ks[1])  # tri stable : l'ordre d'insertion départage
+            ranked = per_tol[target_key] = ranked[:SCORE_TOP_K]
+        return ranked
+
+    def rank_many(self, target_keys, tol: float = FUZZY_REL_ERR, workers: int | None = None,
+                  chunk_size: int | None = None) -> "PatientIndex":
+        """
+        Remplit d'avance les scores (ranked_candidates) des clés cibles qui en
+        auront besoin, par paquets de chunk_size répartis sur un pool de
+        processus. L'index compact (sans les lignes) est envoyé une fois par
+        worker ; les résultats reviennent dans l'ordre et alimentent le cache
+        local, donc best_match_key donne exactement le résultat série.
+        En série (ou en repli si le pool échoue), rien n'est fait d'avance.
+        """
+        workers = MATCH_WORKERS if workers is None else workers
+        if workers <= 1 or not self:
+            return self
+        self.prepare()
+        per_tol = self._per_tol(self._scores, tol)
+        todo = []
+        for k in dict.fromkeys(" ".join(canonical_tokens(t)) for t in target_keys):
+            if k and k not in self and k not in per_tol:
+                todo.append(k)
+        if len(todo) < MATCH_PARALLEL_MIN_KEYS:
+            return self
+        chunk_size = chunk_size or MATCH_CHUNK_SIZE
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_match_worker,
+                                     initargs=(self.compact(),)) as pool:
+                for chunk, ranked in zip(chunks, pool.map(_rank_chunk, chunks, repeat(tol))):
+                    per_tol.update(zip(chunk, ranked))
+        except (BrokenProcessPool, OSError):
+            pass  # le reste est scoré en série par ranked_candidates
+        return self
+
+    def compact(self) -> "PatientIndex":
+        """Copie clés + tableaux de blocage, sans les lignes ni les caches (envoyée aux workers)."""
+        self.prepare()
+        out = PatientIndex()
+        dict.update(out, dict.fromkeys(self._keys, ()))
+        out.__dict__.update(self.__dict__)
+        out._scores = {}
+        out._similar = {}
+        return out
+
+    def _invalidate(self):
+        self._tokens = None
+        self._scores = {}
+        self._similar = {}
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._invalidate()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._invalidate()
+        return super().setdefault(key, default)
+
+
+_worker_index = None  # index compact reçu une fois par processus du pool
+
+
+def _init_match_worker(index: PatientIndex):
+    global _worker_index
+    _worker_index = index
+
+
+def _rank_chunk(target_keys: list, tol: float) -> list:
+    return [_worker_index.ranked_candidates(k, tol) for k in target_keys]
+
+
+def make_index(df: pd.DataFrame, col_name: str) -> dict:
+    idx = PatientIndex()
+    if df is None or df.empty or col_name not in df.columns:
+        return idx
+    for _, r in df.iterrows():
+        key_tokens = canonical_tokens(str(r[col_name]))
+        key = " ".join(key_tokens)
+        if key:
+            idx.setdefault(key, []).append(r)
+    return idx
+
+def _alias_hit(target_key: str, index: dict, score_threshold: float, tol: float,
+               aliases: dict | None) -> str | None:
+    """
+    Alias mémorisé de target_key ({clé cible: (clé index, confirmé)}, cf.
+    aliases.AliasStore) s'il est présent dans l'index : confirmé, il est pris
+    tel quel ; appris automatiquement, il doit encore passer score_threshold
+    à cette tolérance (un run à seuil bas ne s'impose pas aux runs suivants).
+    """
+    if not aliases:
+        return None
+    alias, confirmed = aliases.get(target_key, (None, False))
+    if alias is None or alias not in index:
+        return None
+    if confirmed:
+        return alias
+    match, score = names_match_permissive(target_key, alias, tol)
+    return alias if match and score >= score_threshold else None
+
+def best_match_key(target_name: str, index: dict, score_threshold: float | None = None,
+                   tol: float = FUZZY_REL_ERR, aliases: dict | None = None) -> str | None:
+    """
+    Clé de l'index retenue pour `target_name` (None si aucun candidat n'atteint
+    score_threshold, par défaut SCORE_THRESHOLD).
+    Ordre : clé exacte, puis alias mémorisé (cf. _alias_hit), puis score permissif.
+    Seules les clés partageant un token fuzzy-égal avec la cible sont scorées
+    (les autres ne peuvent pas matcher) ; sur un PatientIndex, les scores déjà
+    calculés à cette tolérance sont réutilisés et seul le seuil est appliqué.
+    """
+    if score_threshold is None:
+        score_threshold = SCORE_THRESHOLD
+    target_key = " ".join(canonical_tokens(target_name))
+    if not target_key or not index:
+        return None
+
+    # priorité: clé exacte, puis alias connu
+    if target_key in index:
+        return target_key
+    alias = _alias_hit(target_key, index, score_threshold, tol, aliases)
+    if alias is not None:
+        return alias
+
+    if isinstance(index, PatientIndex):
+        ranked = index.ranked_candidates(target_key, tol)
+        if ranked and ranked[0][1] >= score_threshold:
+            return ranked[0][0]
+        return None
+
+    best = None
+    best_score = 0.0
+    for cand_key in index:
+        match, score = names_match_permissive(target_key, cand_key, tol)
+        if match and score > best_score:
+            best = cand_key
+            best_score = score
+
+    return best if best_score >= score_threshold else None
+
+def best_match_row(target_name: str, index: dict, score_threshold: float | None = None,
+                   tol: float = FUZZY_REL_ERR, aliases: dict | None = None):
+    """
+    Cherche le meilleur candidat par score permissif (cf. best_match_key).
+    Retourne la ligne si score >= score_threshold (par défaut : SCORE_THRESHOLD).
+    """
+    key = best_match_key(target_name, index, score_threshold, tol, aliases)
+    return None if key is None else index[key][0]
+
+def match_keys(targets, index: dict, score_threshold: float | None = None, tol: float = FUZZY_REL_ERR,
+               aliases: dict | None = None, workers: int | None = None, chunk_size: int | None = None) -> list:
+    """best_match_key pour chaque cible, scores calculés en parallèle si l'index le permet."""
+    targets = list(targets)
+    if isinstance(index, PatientIndex):
+        threshold = SCORE_THRESHOLD if score_threshold is None else score_threshold
+        pending = [t for t in targets if _alias_hit(t, index, threshold, tol, aliases) is None]
+        index.rank_many(pending, tol, workers, chunk_size)
+    return [best_match_key(t, index, score_threshold, tol, aliases) for t in targets]
+
+def _learn_aliases(store, source: str, targets, found: list, mapping: dict):
+    """Mémorise (en attente d'écriture groupée) les matchs fuzzy pas encore connus du store."""
+    if store is None:
+        return
+    new = [(t, k) for t, k in zip(targets, found) if k is not None and k != t and mapping.get(t, (None,))[0] != k]
+    if new:
+        store.record(source, new)
+
+# ==================== MATCHING PAR PATIENT (§3) ====================
+MATCH_SOURCES = ("Desmos", "Cosmident")
+STATUT_BOTH = "🟩 match Desmos + Cosmident"
+STATUT_ONE = "🟦 match d’un seul"
+STATUT_NONE = "🟥 aucun match"
+STATUT_ORPHAN = "🟧 Cosmident sans correspondance"
+
+def _patient_keys(names: pd.Series) -> pd.Series:
+    return names.map(lambda p: " ".join(canonical_tokens(str(p))))
+
+def match_result_keys(df_result: pd.DataFrame, indexes: dict, score_threshold: float,
+                      tol: float = FUZZY_REL_ERR, aliases=None, workers: int | None = None,
+                      chunk_size: int | None = None) -> dict:
+    """
+    {source: clé de l'index retenue pour chaque acte (None sans match)}.
+    Un seul best_match_key par clé patient distincte (un patient a souvent
+    plusieurs dents facturées), résultat recopié en bloc sur les actes.
+    `aliases` (AliasStore, optionnel) : alias consultés avant le score, nouveaux
+    matchs enregistrés en attente (store.flush() en fin de run).
+    workers / chunk_size : cf. PatientIndex.rank_many (résultat identique au mode série).
+    """
+    keys = _patient_keys(df_result["Patient"])
+    uniq = pd.Index(pd.unique(keys))
+    pos = uniq.get_indexer(keys)
+    out = {}
+    for src in MATCH_SOURCES:
+        index = indexes.get(src) or {}
+        mapping = aliases.mapping(src) if aliases is not None else {}
+        found = match_keys(uniq, index, score_threshold, tol, mapping, workers, chunk_size)
+        _learn_aliases(aliases, src, uniq, found, mapping)
+        per_key = np.empty(len(found), dtype=object)
+        per_key[:] = found
+        out[src] = per_key[pos]
+    return out
+
+def match_result_rows(df_result: pd.DataFrame, indexes: dict, score_threshold: float,
+                      tol: float = FUZZY_REL_ERR, aliases=None, workers: int | None = None,
+                      chunk_size: int | None = None, keys: dict | None = None) -> pd.DataFrame:
+    """
+    Colonnes Match / Acte / Prix / Statut par source (indexes = {"Desmos": ..., "Cosmident": ...})
+    + Statut Global, d'après la première ligne du patient retenu dans chaque source.
+    `keys` : résultat de match_result_keys s'il est déjà calculé (sinon calculé ici).
+    """
+    if keys is None:
+        keys = match_result_keys(df_result, indexes, score_threshold, tol, aliases, workers, chunk_size)
+
+    df_out = df_result.copy()
+    matched = {}
+    for src in MATCH_SOURCES:
+        index = indexes.get(src) or {}
+        pos, found = pd.factorize(keys[src], use_na_sentinel=False)
+        rows = [None if pd.isna(f) else index[f][0] for f in found]
+        hit = np.array([r is not None for r in rows], dtype=bool)
+        acte = np.array([str(r.get(f"Acte {src}", "")) if r is not None else "" for r in rows], dtype=object)
+        prix = pd.array([r.get(f"Prix {src}") if r is not None else None for r in rows], dtype="Int64")
+        matched[src] = hit[pos]
+        df_out[f"Match {src}"] = matched[src]
+        df_out[f"Acte {src}"] = pd.Categorical(acte[pos])
+        df_out[f"Prix {src}"] = prix[pos]
+        df_out[f"Statut {src}"] = np.where(matched[src], "match", f"aucun match {src}")
+
+    des, cos = matched["Desmos"], matched["Cosmident"]
+    df_out["Statut Global"] = np.select([des & cos, des ^ cos], [STATUT_BOTH, STATUT_ONE], default=STATUT_NONE)
+    return df_out
+
+def cosmident_orphans(df_cos: pd.DataFrame, index_res: dict, index_des: dict, score_threshold: float,
+                      tol: float = FUZZY_REL_ERR, only_absent_in_result: bool = False,
+                      aliases=None, workers: int | None = None, chunk_size: int | None = None,
+                      window_indexes: dict | None = None) -> pd.DataFrame:
+    """
+    Lignes Cosmident sans patient correspondant (Résultat, et Desmos sauf option), au format du tableau fusionné.
+    window_indexes ({"Résultat": index, "Desmos": index}, cf. history.IndexStore.window_index) :
+    patients des mois voisins ; un patient retrouvé dans l'un d'eux n'est pas orphelin.
+    """
+    if df_cos is None or df_cos.empty:
+        return pd.DataFrame()
+    names = df_cos["Patient"].map(str)
+    keys = _patient_keys(names)
+    uniq = pd.Index(pd.unique(keys))
+    lookups = [("Résultat", index_res)] if only_absent_in_result else [("Résultat", index_res), ("Desmos", index_des)]
+    absent = np.ones(len(uniq), dtype=bool)
+    for src, index in lookups:
+        mapping = aliases.mapping(src) if aliases is not None else {}
+        found = match_keys(uniq, index, score_threshold, tol, mapping, workers, chunk_size)
+        _learn_aliases(aliases, src, uniq, found, mapping)
+        absent &= np.array([f is None for f in found], dtype=bool)
+        window = (window_indexes or {}).get(src)
+        if window and absent.any():
+            still = uniq[absent]
+            found = match_keys(still, window, score_threshold, tol, mapping, workers, chunk_size)
+            absent[np.flatnonzero(absent)] = np.array([f is None for f in found], dtype=bool)
+    mask = absent[uniq.get_indexer(keys)]
+    if not mask.any():
+        return pd.DataFrame()
+
+    orphans = df_cos[mask]
+    n = len(orphans)
+    no_int = pd.array([None] * n, dtype="Int64")
+    return pd.DataFrame({
+        "Patient": names[mask].to_numpy(dtype=object),
+        "Dent": pd.array([None] * n, dtype="Int8"),
+        "Code": [""] * n,
+        "Acte": [""] * n,
+        "Tarif": no_int,
+        "Match Desmos": np.zeros(n, dtype=bool),
+        "Acte Desmos": [""] * n,
+        "Prix Desmos": no_int,
+        "Match Cosmident": np.ones(n, dtype=bool),
+        "Acte Cosmident": orphans["Acte Cosmident"].map(str).to_numpy(dtype=object),
+        "Prix Cosmident": orphans["Prix Cosmident"].array,
+        "Statut Desmos": ["aucun match Desmos"] * n,
+        "Statut Cosmident": ["orphan Cosmident"] * n,
+        "Statut Global": [STATUT_ORPHAN] * n,
+    })
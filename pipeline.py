@@ -0,0 +1,448 @@
+# -*- coding: utf-8 -*-
+"""
+Rapprochement Résultat / Cosmident / Desmos sans Streamlit (import léger,
+utilisable depuis un cron) :
+
+    python pipeline.py 2024-01/ 2024-02/ --out sorties/ [--format parquet]
+
+Chaque dossier mensuel contient l'Excel de facturation, le PDF Cosmident et,
+si disponible, l'Excel Desmos (nom contenant « desmos »). Les mois sont traités
+dans le même processus : fichiers identiques (même contenu) parsés et indexés
+une seule fois, caches de noms de matching.py partagés.
+
+--export-stages écrit aussi les étapes extraites (Resultat / Cosmident /
+Desmos .parquet, colonnes typées) dans sorties/<mois>/ ; un dossier qui
+contient ces fichiers est relu tel quel, sans re-parser l'Excel ni le PDF.
+
+--history historique/ garde les clés patients de chaque mois (history.py) :
+les orphelins Cosmident sont aussi cherchés dans le Résultat et le Desmos
+des mois voisins (--window, de chaque côté), sans relire leurs fichiers.
+Chaque mois est enregistré juste avant d'être traité, avec ses --window
+mois suivants : seuls ces mois-là restent en mémoire.
+"""
+import argparse
+import hashlib
+import io
+import os
+import sys
+from collections import OrderedDict
+from functools import lru_cache, partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from aliases import AliasStore
+from extraction import (
+    DESMOS_COLUMNS, OCR_AVAILABLE, OCR_CACHE_DIR, PARSER_VERSION, DesmosLayouts, collect_billing_acts, display_frame,
+    extract_billing_acts, extract_data_from_cosmident, iter_billing_acts, iter_excel_rows, read_desmos_excel,
+)
+from history import HISTORY_WINDOW, IndexStore
+from ingestion import Ingestion
+from matching import (
+    FUZZY_REL_ERR, SCORE_THRESHOLD, cosmident_orphans, make_index, match_result_keys, match_result_rows,
+)
+from reconciliation import CONTROL_GAP, PRICE_TOLERANCE, reconcile_prices
+
+EXCEL_SUFFIXES = (".xls", ".xlsx")
+DIGEST_CACHE_SIZE = 256
+
+# ==================== EXTRACTION (fichiers sur disque) ====================
+def load_billing(path, stream: bool = False) -> pd.DataFrame:
+    path = Path(path)
+    is_xlsx = path.suffix.lower() == ".xlsx"
+    if stream:
+        return collect_billing_acts(iter_billing_acts(iter_excel_rows(path, xlsx=is_xlsx)))
+    df_raw = pd.read_excel(path, header=None, engine="openpyxl" if is_xlsx else "xlrd")
+    return extract_billing_acts(df_raw)
+
+def load_cosmident(path, workers: int | None = None, ocr: bool = False, ocr_cache=OCR_CACHE_DIR) -> pd.DataFrame:
+    """Lignes Cosmident ; les pages dont l'OCR échoue sont signalées sur stderr."""
+    path = Path(path)
+
+    def report(warning: str | None = None, **counts):
+        if warning is not None:
+            print(f"{path} : {warning}", file=sys.stderr)
+
+    df, _ = extract_data_from_cosmident(path.read_bytes(), workers=workers, ocr=ocr, ocr_cache=ocr_cache,
+                                        progress=report)
+    return df
+
+def load_desmos(path, layouts: DesmosLayouts | None = None) -> pd.DataFrame:
+    """
+    Desmos ramené à DESMOS_COLUMNS ; si les colonnes ne sont ni mémorisées ni
+    détectées, erreur (l'échantillon de détection n'est jamais matché).
+    """
+    path = Path(path)
+    df = read_desmos_excel(path, xlsx=path.suffix.lower() == ".xlsx", layouts=layouts)
+    check_desmos_columns(df, path)
+    return df
+
+def check_desmos_columns(df: pd.DataFrame, path):
+    if list(df.columns) == DESMOS_COLUMNS:
+        return
+    header = [str(c) for c in df.columns]
+    template = ", ".join(f'"{role}": "…"' for role in DESMOS_COLUMNS)
+    raise ValueError(
+        f"{Path(path).name} : colonnes Patient/Acte/Prix Desmos non détectées (en-têtes : {header}). "
+        f"Indiquer la disposition dans --desmos-layouts (entrée \"{DesmosLayouts.signature(header)}\": "
+        f"{{{template}}}, noms d'en-têtes du fichier), ou la choisir une fois dans l'application."
+    )
+
+# ==================== EXPORT / IMPORT DES ÉTAPES (Parquet) ====================
+# Étapes extraites réutilisables (colonnes typées conservées) : nom de fichier par source
+STAGE_NAMES = {"facturation": "Resultat", "cosmident": "Cosmident", "desmos": "Desmos"}
+# source de l'historique multi-mois -> étape
+HISTORY_STAGES = {"Résultat": "facturation", "Desmos": "desmos", "Cosmident": "cosmident"}
+
+def to_parquet_bytes(df: pd.DataFrame, stage: str | None = None) -> bytes:
+    """
+    Parquet (colonnes typées) ; version du parseur et étape (clé de STAGE_NAMES,
+    None pour un tableau qui n'est pas une étape) dans les métadonnées.
+    """
+    df = df.copy(deep=False)
+    df.attrs["parser_version"] = PARSER_VERSION
+    df.attrs["stage"] = stage
+    buf = io.BytesIO()
+    df.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """CSV « ; » UTF-8 avec BOM (Excel), colonnes remises en texte."""
+    return display_frame(df).to_csv(index=False, sep=";").encode("utf-8-sig")
+
+def read_stage(file, expected_stage: str) -> pd.DataFrame:
+    """
+    Étape `expected_stage` exportée par to_parquet_bytes ; refusée si c'est une
+    autre étape (ou un autre tableau) ou si le parseur a changé depuis l'export.
+    """
+    df = pd.read_parquet(file)
+    stage = df.attrs.get("stage")
+    if stage != expected_stage:
+        found = f"l'étape {STAGE_NAMES[stage]}" if stage in STAGE_NAMES else "un fichier qui n'est pas une étape"
+        raise ValueError(f"{found} au lieu de l'étape {STAGE_NAMES[expected_stage]} attendue ici")
+    version = df.attrs.get("parser_version")
+    if version != PARSER_VERSION:
+        raise ValueError(f"étape exportée par une autre version du parseur ({version}, attendu {PARSER_VERSION}) : "
+                         "recharger le fichier source")
+    return df
+
+def stage_role(path) -> str | None:
+    """Source d'un fichier d'étape (Resultat.parquet -> "facturation"), None sinon."""
+    path = Path(path)
+    if path.suffix.lower() != ".parquet":
+        return None
+    stem = path.stem.lower()
+    return next((role for role, name in STAGE_NAMES.items() if stem == name.lower()), None)
+
+# ==================== MATCHING + STATUTS ====================
+def fuse(df_result: pd.DataFrame, df_cos: pd.DataFrame, index_res: dict, index_des: dict, index_cos: dict,
+         score_threshold: float = SCORE_THRESHOLD, tol: float = FUZZY_REL_ERR,
+         only_absent_in_result: bool = False, aliases=None, match_workers: int | None = None,
+         chunk_size: int | None = None, price_tol: int = PRICE_TOLERANCE,
+         window_indexes: dict | None = None) -> tuple[pd.DataFrame, int]:
+    """
+    (tableau fusionné orphelins Cosmident en tête, nombre d'orphelins).
+    `aliases` (AliasStore) : consulté avant le score fuzzy ; les nouveaux matchs
+    restent en attente jusqu'à aliases.flush().
+    match_workers / chunk_size : scoring réparti sur un pool de processus
+    (None : MATCH_WORKERS / MATCH_CHUNK_SIZE de matching.py), même résultat qu'en série.
+    price_tol : écart (centimes) toléré entre Tarif et prix apparié avant alerte.
+    window_indexes : Résultat / Desmos des mois voisins pour les orphelins (cf. history.py).
+    """
+    indexes = {"Desmos": index_des, "Cosmident": index_cos}
+    keys = match_result_keys(df_result, indexes, score_threshold, tol, aliases=aliases,
+                             workers=match_workers, chunk_size=chunk_size)
+    df_out = match_result_rows(df_result, indexes, score_threshold, tol, keys=keys)
+    df_out = reconcile_prices(df_out, keys, indexes, price_tol)
+    orphans = cosmident_orphans(df_cos, index_res, index_des, score_threshold, tol,
+                                only_absent_in_result=only_absent_in_result, aliases=aliases,
+                                workers=match_workers, chunk_size=chunk_size, window_indexes=window_indexes)
+    df_final = pd.concat([orphans, df_out], ignore_index=True)
+    for src in ("Desmos", "Cosmident"):
+        df_final[f"Contrôle {src}"] = df_final[f"Contrôle {src}"].fillna("")
+    return df_final, len(orphans)
+
+# ==================== MISE EN COULEUR ====================
+# Classe de couleur calculée une fois pour tout le tableau (catégorielle) ;
+# le CSS n'est produit que pour les lignes affichées.
+ROW_COLORS = {
+    "vert": "background-color: #c6f6d5;",    # 🟩 vert clair
+    "bleu": "background-color: #cfe8ff;",    # 🟦 bleu clair
+    "orange": "background-color: #ffe5b4;",  # 🟧 orange pâle
+    "rouge": "background-color: #ffd6d6;",   # 🟥 rouge clair (et tout le reste)
+}
+STATUS_CLASSES = {"🟩": "vert", "🟦": "bleu", "🟧": "orange"}
+NO_DESMOS_CELL = "background-color: #fff3cd;"     # jaune pâle
+NO_COSMIDENT_CELL = "background-color: #ffe5b4;"  # orange pâle
+PRICE_GAP_CELL = "background-color: #f5c2c7;"     # rose : écart de prix
+
+def row_classes(df: pd.DataFrame) -> pd.Categorical:
+    """Couleur de chaque ligne d'après le préfixe de Statut Global."""
+    first = df["Statut Global"].astype(str).str[:1].map(STATUS_CLASSES).fillna("rouge")
+    return pd.Categorical(first, categories=list(ROW_COLORS))
+
+def page_styles(df: pd.DataFrame, classes) -> pd.DataFrame:
+    """
+    CSS cellule par cellule pour les lignes `df` (à passer à Styler.apply(axis=None)) :
+    fond selon la classe de ligne, Statut Desmos / Cosmident surlignés si pas de match.
+    """
+    lut = np.array(list(ROW_COLORS.values()), dtype=object)
+    base = lut[pd.Categorical(classes, categories=list(ROW_COLORS)).codes]
+    styles = pd.DataFrame(np.repeat(base[:, None], df.shape[1], axis=1), index=df.index, columns=df.columns)
+    if "Statut Desmos" in df.columns:
+        mask = df["Statut Desmos"].astype(str).str.contains("aucun match Desmos", regex=False).to_numpy(dtype=bool)
+        styles.loc[mask, "Statut Desmos"] = NO_DESMOS_CELL
+    if "Statut Cosmident" in df.columns:
+        stat_cos = df["Statut Cosmident"].astype(str)
+        mask = (stat_cos.str.contains("aucun match Cosmident", regex=False)
+                | stat_cos.str.contains("orphan Cosmident", regex=False)).to_numpy(dtype=bool)
+        styles.loc[mask, "Statut Cosmident"] = NO_COSMIDENT_CELL
+    for src in ("Desmos", "Cosmident"):
+        col = f"Contrôle {src}"
+        if col in df.columns:
+            mask = df[col].astype(str).eq(CONTROL_GAP).to_numpy(dtype=bool)
+            styles.loc[mask, [col, f"Écart {src}"]] = PRICE_GAP_CELL
+    return styles
+
+# ==================== TRAITEMENT PAR LOTS ====================
+def file_digest(path) -> str:
+    """sha256 du contenu, recalculé seulement si le fichier a changé (chemin, mtime, taille)."""
+    stat = os.stat(path)
+    return _file_digest(str(Path(path).resolve()), stat.st_mtime_ns, stat.st_size)
+
+@lru_cache(maxsize=DIGEST_CACHE_SIZE)
+def _file_digest(path: str, mtime_ns: int, size: int) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def discover_month(folder) -> dict:
+    """
+    Fichiers d'un dossier mensuel : {"facturation", "cosmident", "desmos"} -> chemin ou None.
+    Une étape déjà exportée (Resultat.parquet…) passe avant le fichier source.
+    """
+    folder = Path(folder)
+    found = {"facturation": None, "cosmident": None, "desmos": None}
+    paths = sorted(folder.iterdir())
+    for p in paths:
+        role = stage_role(p)
+        if role is not None:
+            found[role] = p
+    for p in paths:
+        suffix = p.suffix.lower()
+        if suffix == ".pdf" and found["cosmident"] is None:
+            found["cosmident"] = p
+        elif suffix in EXCEL_SUFFIXES:
+            role = "desmos" if "desmos" in p.name.lower() else "facturation"
+            if found[role] is None:
+                found[role] = p
+    return found
+
+
+class BatchRunner:
+    """
+    Enchaîne les mois en gardant frames et index par (source, hash du fichier) :
+    un export Desmos partagé entre plusieurs mois n'est lu et indexé qu'une fois.
+    Seuls les max_files derniers fichiers utilisés restent en mémoire (un mois,
+    plus les `window` mois suivants déjà enregistrés dans l'historique).
+    """
+
+    def __init__(self, score_threshold: float = SCORE_THRESHOLD, tol: float = FUZZY_REL_ERR,
+                 only_absent_in_result: bool = False, stream: bool = False, workers: int | None = None,
+                 aliases=None, match_workers: int | None = None, chunk_size: int | None = None,
+                 price_tol: int = PRICE_TOLERANCE, ocr: bool = False, ocr_cache=OCR_CACHE_DIR,
+                 history: IndexStore | None = None, window: int = HISTORY_WINDOW,
+                 desmos_layouts: DesmosLayouts | None = None):
+        self.score_threshold = score_threshold
+        self.tol = tol
+        self.only_absent_in_result = only_absent_in_result
+        self.stream = stream
+        self.workers = workers
+        self.aliases = aliases
+        self.match_workers = match_workers
+        self.chunk_size = chunk_size
+        self.price_tol = price_tol
+        self.ocr = ocr
+        self.ocr_cache = ocr_cache
+        self.history = history
+        self.window = window
+        self.desmos_layouts = desmos_layouts
+        self.max_files = len(STAGE_NAMES) * (1 + (window if history is not None else 0))
+        self._loaded = OrderedDict()  # (source, hash, version) -> (frame, index), du plus ancien au plus récent
+
+    def _load(self, source: str, path) -> tuple[pd.DataFrame, dict]:
+        if path is None:
+            return pd.DataFrame(), {}
+        key = (source, file_digest(path), PARSER_VERSION)
+        if key in self._loaded:
+            self._loaded.move_to_end(key)
+        else:
+            if stage_role(path) == source:
+                df = read_stage(path, source)
+            elif source == "facturation":
+                df = load_billing(path, stream=self.stream)
+            elif source == "cosmident":
+                df = load_cosmident(path, workers=self.workers, ocr=self.ocr, ocr_cache=self.ocr_cache)
+            else:
+                df = load_desmos(path, layouts=self.desmos_layouts)
+            if source == "desmos":
+                check_desmos_columns(df, path)
+            self._loaded[key] = (df, make_index(df, "Patient") if not df.empty else {})
+            while len(self._loaded) > self.max_files:
+                self._loaded.popitem(last=False)
+        return self._loaded[key]
+
+    def export_stages(self, files: dict, folder: Path) -> list:
+        """Écrit les étapes extraites du mois (Parquet) dans folder ; rend les chemins écrits."""
+        folder.mkdir(parents=True, exist_ok=True)
+        written = []
+        for source, name in STAGE_NAMES.items():
+            df, _ = self._load(source, files.get(source))
+            if not df.empty:
+                path = folder / f"{name}.parquet"
+                path.write_bytes(to_parquet_bytes(df, source))
+                written.append(path)
+        return written
+
+    def load_month(self, files: dict) -> dict:
+        """Les trois sources lues et indexées en parallèle : {source: (frame, index)}."""
+        loaded = {}
+        with Ingestion() as ingest:
+            for source in STAGE_NAMES:
+                ingest.submit(source, partial(self._load_frame, loaded, source, files.get(source)))
+            for task in ingest.as_completed():
+                if task.error is not None:
+                    raise task.error
+        return {source: loaded[source] for source in STAGE_NAMES}
+
+    def _load_frame(self, loaded: dict, source: str, path, task) -> pd.DataFrame:
+        loaded[source] = self._load(source, path)
+        return loaded[source][0]
+
+    def release(self):
+        """Libère frames et index gardés (fin de lot)."""
+        self._loaded.clear()
+
+    def record_month(self, files: dict, month: str):
+        """Ajoute les clés patients du mois (trois sources) à l'historique."""
+        loaded = self.load_month(files)
+        for source, stage in HISTORY_STAGES.items():
+            self.history.add_month(source, month, loaded[stage][1])
+
+    def window_indexes(self, month: str) -> dict | None:
+        if self.history is None or month is None:
+            return None
+        months = self.history.window(month, self.window)
+        return {src: self.history.window_index(src, months) for src in ("Résultat", "Desmos")}
+
+    def run_month(self, files: dict, month: str | None = None) -> pd.DataFrame:
+        loaded = self.load_month(files)
+        df_result, index_res = loaded["facturation"]
+        if df_result.empty:
+            return pd.DataFrame()
+        df_cos, index_cos = loaded["cosmident"]
+        _, index_des = loaded["desmos"]
+        df_final, _ = fuse(df_result, df_cos, index_res, index_des, index_cos,
+                           self.score_threshold, self.tol, self.only_absent_in_result, aliases=self.aliases,
+                           match_workers=self.match_workers, chunk_size=self.chunk_size,
+                           price_tol=self.price_tol, window_indexes=self.window_indexes(month))
+        if self.aliases is not None:
+            self.aliases.flush()
+        return df_final
+
+
+def write_output(df: pd.DataFrame, path: Path, fmt: str) -> Path:
+    """CSV : colonnes remises en texte (display_frame) ; Parquet : colonnes typées telles quelles."""
+    if fmt == "parquet":
+        path = path.with_suffix(".parquet")
+        path.write_bytes(to_parquet_bytes(df))
+    else:
+        path = path.with_suffix(".csv")
+        path.write_bytes(to_csv_bytes(df))
+    return path
+
+
+def main(argv: list | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Rapprochement Résultat / Cosmident / Desmos (mode batch).")
+    parser.add_argument("months", nargs="+", type=Path, help="dossiers mensuels (facturation + Cosmident + Desmos)")
+    parser.add_argument("--out", type=Path, default=Path("."), help="dossier de sortie")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--export-stages", action="store_true",
+                        help="écrit aussi Resultat/Cosmident/Desmos.parquet dans <out>/<mois>/ (relisibles)")
+    parser.add_argument("--tolerance", type=float, default=FUZZY_REL_ERR, help="tolérance aux fautes (0.05–0.40)")
+    parser.add_argument("--threshold", type=float, default=SCORE_THRESHOLD, help="seuil de score global")
+    parser.add_argument("--orphans-absent-in-result", action="store_true",
+                        help="orphelins Cosmident = absents du Résultat (peu importe Desmos)")
+    parser.add_argument("--stream", action="store_true", help="lecture en flux de l'Excel de facturation (.xlsx ; un .xls est chargé en entier)")
+    parser.add_argument("--workers", type=int, default=None, help="processus pour l'extraction PDF")
+    parser.add_argument("--ocr", action="store_true", help="OCR des pages Cosmident scannées (pytesseract)")
+    parser.add_argument("--ocr-cache", type=Path, default=Path(OCR_CACHE_DIR),
+                        help="dossier du cache du texte OCR (par hash d'image de page)")
+    parser.add_argument("--history", type=Path, default=None,
+                        help="dossier de l'historique des clés patients (complété à chaque mois traité)")
+    parser.add_argument("--window", type=int, default=HISTORY_WINDOW,
+                        help="mois voisins (de chaque côté) consultés pour les orphelins Cosmident")
+    parser.add_argument("--desmos-layouts", type=Path, default=None,
+                        help="fichier JSON des colonnes Desmos retenues par disposition (détection sautée ensuite)")
+    parser.add_argument("--match-workers", type=int, default=None,
+                        help="processus pour le matching (1 : série ; défaut : tous les cœurs)")
+    parser.add_argument("--chunk-size", type=int, default=None, help="clés patient par tâche de matching")
+    parser.add_argument("--price-tolerance", type=float, default=PRICE_TOLERANCE / 100,
+                        help="écart de prix toléré (€) avant alerte « écart de prix »")
+    parser.add_argument("--aliases", type=Path, default=None,
+                        help="base SQLite des correspondances mémorisées (lue puis complétée)")
+    args = parser.parse_args(argv)
+    if args.ocr and not OCR_AVAILABLE:
+        parser.error("--ocr : pytesseract et le binaire tesseract (langue fra) sont requis")
+
+    aliases = AliasStore(args.aliases) if args.aliases else None
+    runner = BatchRunner(args.threshold, args.tolerance, args.orphans_absent_in_result,
+                         stream=args.stream, workers=args.workers, aliases=aliases,
+                         match_workers=args.match_workers, chunk_size=args.chunk_size,
+                         price_tol=round(args.price_tolerance * 100), ocr=args.ocr, ocr_cache=args.ocr_cache,
+                         history=IndexStore(args.history) if args.history else None, window=args.window,
+                         desmos_layouts=DesmosLayouts(args.desmos_layouts) if args.desmos_layouts else None)
+    args.out.mkdir(parents=True, exist_ok=True)
+    status = 0
+    recorded = set()
+    for i, folder in enumerate(args.months):
+        # historique : le mois et ses `window` suivants enregistrés avant son traitement
+        # (chaque mois voit aussi ses suivants ; au plus window + 1 mois en mémoire)
+        upcoming_months = args.months[i:i + 1 + args.window] if runner.history is not None else []
+        for upcoming in upcoming_months:
+            if upcoming in recorded:
+                continue
+            recorded.add(upcoming)
+            upcoming_files = discover_month(upcoming)
+            if upcoming_files["facturation"] is not None:
+                try:
+                    runner.record_month(upcoming_files, upcoming.name)
+                except Exception as e:
+                    print(f"{upcoming} : historique non mis à jour — {e}", file=sys.stderr)
+        files = discover_month(folder)
+        if files["facturation"] is None:
+            print(f"{folder} : pas d'Excel de facturation, ignoré", file=sys.stderr)
+            status = 1
+            continue
+        try:
+            df_final = runner.run_month(files, folder.name)
+        except Exception as e:
+            print(f"{folder} : erreur — {e}", file=sys.stderr)
+            status = 1
+            continue
+        if df_final.empty:
+            print(f"{folder} : aucun acte prothétique trouvé", file=sys.stderr)
+            continue
+        out = write_output(df_final, args.out / f"Fusion_{folder.name}", args.format)
+        if args.export_stages:
+            runner.export_stages(files, args.out / folder.name)
+        counts = df_final["Statut Global"].str[:1].value_counts().to_dict()
+        print(f"{folder} : {len(df_final)} lignes -> {out}  {counts}")
+    runner.release()
+    if aliases is not None:
+        aliases.close()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
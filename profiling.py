@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation légère (sans dépendance Streamlit) : chronos par étape,
+lignes/s, compteurs d'appels des fonctions de matching, export JSON.
+
+    prof = Profiler(count_calls=True)
+    with prof.counting():
+        with prof.stage("matching", rows=len(df)):
+            ...
+    prof.to_json()
+
+Les compteurs vivent dans matching (matching.CALLS, alimenté seulement si
+matching.COUNT_CALLS) : counting() lève le drapeau pendant le bloc et
+retient les appels comptés entre l'entrée et la sortie.
+
+Une étape chronométrée pendant une autre (parseurs lancés dans le bloc
+d'ingestion, par ex.) la nomme dans `within` : elle reste dans le détail
+mais n'entre pas dans total_seconds (son temps est déjà dans le parent).
+"""
+import json
+import platform
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+import matching
+
+
+class Profiler:
+    def __init__(self, count_calls: bool = False):
+        self.count_calls = count_calls
+        self.stages = []
+        self.calls = Counter()
+        self.started = datetime.now().isoformat(timespec="seconds")
+
+    @contextmanager
+    def stage(self, name: str, rows: int | None = None, within: str | None = None):
+        """
+        Chronomètre un bloc ; `rows` (ou entry["lignes"] fixé dans le bloc) donne le débit.
+        `within` : étape englobante (temps non recompté dans le total).
+        """
+        entry = {"etape": name, "secondes": 0.0, "lignes": rows}
+        if within is not None:
+            entry["dans"] = within
+        t0 = time.perf_counter()
+        try:
+            yield entry
+        finally:
+            entry["secondes"] = time.perf_counter() - t0
+            if entry["lignes"] and entry["secondes"] > 0:
+                entry["lignes_par_s"] = entry["lignes"] / entry["secondes"]
+            self.stages.append(entry)
+
+    @contextmanager
+    def counting(self):
+        """Compte les appels des COUNTED_FUNCTIONS pendant le bloc (si count_calls)."""
+        if not self.count_calls:
+            yield
+            return
+        enabled = matching.COUNT_CALLS
+        before = matching.CALLS.copy()
+        matching.COUNT_CALLS = True
+        try:
+            yield
+        finally:
+            matching.COUNT_CALLS = enabled
+            self.calls.update(matching.CALLS - before)
+
+    def total_seconds(self) -> float:
+        """Somme des étapes de premier niveau (sans celles chronométrées dans une autre)."""
+        return sum(s["secondes"] for s in self.stages if "dans" not in s)
+
+    def report(self) -> dict:
+        return {
+            "debut": self.started,
+            "python": platform.python_version(),
+            "etapes": self.stages,
+            "total_s": self.total_seconds(),
+            "appels": dict(self.calls),
+            "caches": matching.cache_stats(),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.report(), indent=2, ensure_ascii=False)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Rapprochement acte par acte (sans dépendance Streamlit).
+
+Pour chaque patient retrouvé dans une source (clés de match_result_keys), les
+actes facturés (Tarif) sont appariés aux lignes Desmos / Cosmident de ce
+patient par montant, en opérations groupées (pas de boucle par patient) :
+
+1. montants identiques : le i-ème acte à X € avec la i-ème ligne à X € ;
+2. restes : montant le plus proche (merge_asof par patient, dans la fenêtre
+   PRICE_PAIR_WINDOW), chaque ligne source servant au plus une fois ; la
+   passe est répétée sur les actes et lignes encore libres jusqu'à stabilité.
+
+Les lignes Desmos / Cosmident ne portent pas de numéro de dent : l'appariement
+se fait sur le montant seul.
+
+Colonnes ajoutées par source : Écart (prix apparié - Tarif, centimes) et
+Contrôle (ok / écart de prix / non apparié ; vide si patient sans match).
+"""
+import numpy as np
+import pandas as pd
+
+from matching import MATCH_SOURCES
+
+PRICE_PAIR_WINDOW = 100_00  # centimes : au-delà, une ligne n'est pas appariée à l'acte
+PRICE_TOLERANCE = 0         # centimes : écart toléré avant alerte
+
+CONTROL_OK = "ok"
+CONTROL_GAP = "écart de prix"
+CONTROL_UNPAIRED = "non apparié"
+
+
+def source_lines(index: dict, patient_keys, src: str) -> pd.DataFrame:
+    """Lignes (pid = position dans patient_keys, ligne, montant) des patients retenus, prix connus seulement."""
+    pid, amount = [], []
+    for p, key in enumerate(patient_keys):
+        for r in index[key]:
+            v = r.get(f"Prix {src}")
+            if not pd.isna(v):
+                pid.append(p)
+                amount.append(int(v))
+    return pd.DataFrame({
+        "pid": np.array(pid, dtype=np.int64),
+        "ligne": np.arange(len(pid), dtype=np.int64),
+        "montant": np.array(amount, dtype=np.int64),
+    })
+
+
+def pair_amounts(acts: pd.DataFrame, lines: pd.DataFrame, window: int = PRICE_PAIR_WINDOW) -> pd.DataFrame:
+    """
+    acts (pid, acte, montant) x lines (pid, ligne, montant) -> paires (acte, montant_src),
+    un acte et une ligne au plus une fois chacun.
+    """
+    acts = acts.assign(occ=acts.groupby(["pid", "montant"]).cumcount())
+    lines = lines.assign(occ=lines.groupby(["pid", "montant"]).cumcount())
+    exact = acts.merge(lines, on=["pid", "montant", "occ"])[["acte", "ligne", "montant"]]
+    exact = exact.rename(columns={"montant": "montant_src"})
+
+    rest_a = acts[~acts["acte"].isin(exact["acte"])].sort_values("montant", kind="stable")
+    rest_l = lines[~lines["ligne"].isin(exact["ligne"])].rename(columns={"montant": "montant_src"})
+    rest_l = rest_l.sort_values("montant_src", kind="stable")[["pid", "ligne", "montant_src"]]
+    pairs = [exact[["acte", "montant_src"]]]
+    # passes successives : un acte qui perd sa ligne la plus proche retente sur les lignes restantes
+    while not rest_a.empty and not rest_l.empty:
+        near = pd.merge_asof(rest_a, rest_l, left_on="montant", right_on="montant_src", by="pid",
+                             direction="nearest", tolerance=window)
+        near = near.dropna(subset=["ligne"])
+        if near.empty:
+            break
+        # une ligne réclamée par plusieurs actes va au plus proche (puis au premier acte)
+        near = near.assign(ecart=(near["montant_src"] - near["montant"]).abs())
+        near = near.sort_values(["ecart", "acte"], kind="stable").drop_duplicates("ligne")
+        near = near.astype({"montant_src": np.int64, "ligne": np.int64})
+        pairs.append(near[["acte", "montant_src"]])
+        rest_a = rest_a[~rest_a["acte"].isin(near["acte"])]
+        rest_l = rest_l[~rest_l["ligne"].isin(near["ligne"])]
+    return pd.concat(pairs, ignore_index=True)
+
+
+def reconcile_prices(df_out: pd.DataFrame, keys: dict, indexes: dict, price_tol: int = PRICE_TOLERANCE,
+                     window: int = PRICE_PAIR_WINDOW) -> pd.DataFrame:
+    """Ajoute Écart / Contrôle par source à df_out (lignes dans l'ordre de keys)."""
+    tarif = df_out["Tarif"].astype("Int64")
+    has_tarif = tarif.notna().to_numpy()
+    cents = tarif.to_numpy(dtype=np.int64, na_value=0)
+    for src in MATCH_SOURCES:
+        found = keys[src]
+        matched = ~pd.isna(found)
+        pid, patient_keys = pd.factorize(found[matched])
+        acts = pd.DataFrame({"pid": pid.astype(np.int64), "acte": np.flatnonzero(matched)})
+        acts = acts[has_tarif[acts["acte"]]]
+        acts = acts.assign(montant=cents[acts["acte"]])
+        lines = source_lines(indexes.get(src) or {}, patient_keys, src)
+        pairs = pair_amounts(acts, lines, window)
+
+        ecart = np.zeros(len(df_out), dtype=np.int64)
+        paired = np.zeros(len(df_out), dtype=bool)
+        rows = pairs["acte"].to_numpy(dtype=np.int64)
+        ecart[rows] = pairs["montant_src"].to_numpy(dtype=np.int64) - cents[rows]
+        paired[rows] = True
+
+        control = np.where(matched, CONTROL_UNPAIRED, "").astype(object)
+        control[paired] = np.where(np.abs(ecart[paired]) <= price_tol, CONTROL_OK, CONTROL_GAP)
+        df_out[f"Écart {src}"] = pd.arrays.IntegerArray(ecart, ~paired)
+        df_out[f"Contrôle {src}"] = control
+    return df_out
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Modules du dépôt importables depuis tests/ (pas de paquet installé)
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
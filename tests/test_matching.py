@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Distance bornée (fuzzy_equal / levenshtein_within) contre l'ancien test
+`levenshtein(a, b) / L <= tol`, et scoring parallèle contre le mode série.
+"""
+import random
+
+import pandas as pd
+import pytest
+
+import matching
+from matching import (
+    MYERS_MAX_LEN, PatientIndex, _banded_within, fuzzy_equal, levenshtein, levenshtein_within,
+    make_index, match_keys, max_edits,
+)
+
+TOLERANCES = (0.0, 0.1, 0.15, 0.2, 0.25, 1 / 3, 0.5)
+
+
+def old_fuzzy_equal(a: str, b: str, tol: float) -> bool:
+    """fuzzy_equal d'avant la distance bornée (distance complète)."""
+    if a == b:
+        return True
+    if not a or not b:
+        return False
+    return levenshtein(a, b) / max(len(a), len(b)) <= tol
+
+
+def mutate(rng: random.Random, s: str, edits: int, alphabet: str) -> str:
+    s = list(s)
+    for _ in range(edits):
+        op = rng.randrange(3)
+        i = rng.randrange(len(s) + 1)
+        if op == 0 or not s:
+            s.insert(i, rng.choice(alphabet))
+        elif op == 1:
+            del s[min(i, len(s) - 1)]
+        else:
+            s[min(i, len(s) - 1)] = rng.choice(alphabet)
+    return "".join(s)
+
+
+def random_pairs(seed: int, n: int, min_len: int, max_len: int, alphabet: str = "abcdeéhlmnrt"):
+    rng = random.Random(seed)
+    for _ in range(n):
+        a = "".join(rng.choice(alphabet) for _ in range(rng.randint(min_len, max_len)))
+        yield a, mutate(rng, a, rng.randint(0, max(1, len(a) // 3)), alphabet)
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches():
+    matching.clear_caches()
+    yield
+    matching.clear_caches()
+
+
+# ==================== DISTANCE BORNÉE ====================
+@pytest.mark.parametrize("tol", TOLERANCES)
+def test_fuzzy_equal_matches_old_check(tol):
+    for a, b in random_pairs(seed=1, n=1500, min_len=1, max_len=20):
+        assert fuzzy_equal(a, b, tol) == old_fuzzy_equal(a, b, tol), (a, b, tol)
+        assert fuzzy_equal(b, a, tol) == old_fuzzy_equal(a, b, tol), (b, a, tol)
+
+
+def test_empty_strings():
+    assert fuzzy_equal("", "")
+    assert not fuzzy_equal("", "a")
+    assert not fuzzy_equal("dupont", "", 1.0)
+    assert levenshtein("", "abc") == 3
+    assert levenshtein_within("", "", 0)
+    assert levenshtein_within("", "abc", 3)
+    assert not levenshtein_within("", "abc", 2)
+    assert not levenshtein_within("abc", "", 2)
+
+
+@pytest.mark.parametrize("k", [0, 1, 2, 5, 16])
+def test_banded_path_long_strings(k):
+    # len >= MYERS_MAX_LEN : levenshtein_within passe par la DP en bande
+    for a, b in random_pairs(seed=2, n=60, min_len=MYERS_MAX_LEN, max_len=MYERS_MAX_LEN + 40):
+        d = levenshtein(a, b)
+        assert levenshtein_within(a, b, k) == (d <= k), (a, b, k, d)
+        if min(len(a), len(b)) >= MYERS_MAX_LEN and abs(len(a) - len(b)) <= k:
+            short, long_ = sorted((a, b), key=len)
+            assert _banded_within(short, long_, k) == (d <= k)
+
+
+def test_myers_and_banded_agree_at_boundary():
+    rng = random.Random(3)
+    for length in (MYERS_MAX_LEN - 1, MYERS_MAX_LEN, MYERS_MAX_LEN + 1):
+        for _ in range(40):
+            a = "".join(rng.choice("abc") for _ in range(length))
+            b = mutate(rng, a, rng.randint(0, 6), "abc")
+            d = levenshtein(a, b)
+            for k in (d - 1, d, d + 1):
+                assert levenshtein_within(a, b, k) == (k >= 0 and d <= k), (length, k, d)
+
+
+def test_k_boundaries():
+    for a, b in random_pairs(seed=4, n=500, min_len=0, max_len=12):
+        d = levenshtein(a, b)
+        assert not levenshtein_within(a, b, -1)
+        assert levenshtein_within(a, b, d)
+        assert levenshtein_within(a, b, d + 1)
+        if d > 0:
+            assert not levenshtein_within(a, b, d - 1)
+        assert levenshtein_within(a, b, 0) == (a == b)
+
+
+@pytest.mark.parametrize("tol", TOLERANCES)
+def test_max_edits_is_old_float_comparison(tol):
+    for L in range(1, 130):
+        k = max_edits(L, tol)
+        assert k / L <= tol
+        assert (k + 1) / L > tol
+
+
+# ==================== SCORING PARALLÈLE ====================
+FIRST = ["jean", "marie", "pierre", "helene", "louis", "claire", "paul", "anne"]
+LAST = ["dupont", "durand", "martin", "bernard", "petit", "moreau", "lefebvre", "garnier"]
+
+
+def patients(seed: int, n: int) -> list:
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        name = f"{rng.choice(LAST)} {rng.choice(FIRST)}"
+        out.append(mutate(rng, name, rng.randint(0, 2), "aeilnrt"))
+    return out
+
+
+def patient_index(names: list) -> PatientIndex:
+    return make_index(pd.DataFrame({"Patient": names}), "Patient")
+
+
+@pytest.mark.parametrize("tol,threshold", [(0.2, 0.5), (0.34, 0.8)])
+def test_parallel_ranking_identical_to_serial(monkeypatch, tol, threshold):
+    monkeypatch.setattr(matching, "MATCH_PARALLEL_MIN_KEYS", 1)
+    names, targets = patients(5, 300), patients(6, 200)
+
+    serial = match_keys(targets, patient_index(names), threshold, tol, workers=1)
+
+    index = patient_index(names)
+    index.rank_many(targets, tol, workers=2, chunk_size=16)
+    assert index._scores.get(tol), "le pool n'a rien scoré d'avance"
+    assert index.rank_many(targets, tol, workers=2, chunk_size=16) is index
+    parallel = [matching.best_match_key(t, index, threshold, tol) for t in targets]
+    assert parallel == serial
+    assert match_keys(targets, patient_index(names), threshold, tol, workers=2, chunk_size=16) == serial
+
+
+def test_serial_rank_many_precomputes_nothing():
+    index = patient_index(patients(7, 50))
+    index.rank_many(patients(8, 20), workers=1)
+    assert not index._scores
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import matching
+from profiling import Profiler
+
+
+def test_counting_only_inside_block():
+    prof = Profiler(count_calls=True)
+    matching.fuzzy_equal("dupont", "dupond")
+    with prof.counting():
+        matching.fuzzy_equal("durand", "durant")
+        matching.names_match_permissive("DURAND Marie", "DURANT Marie")
+    matching.fuzzy_equal("martin", "martine")
+    assert not matching.COUNT_CALLS
+    assert prof.calls["fuzzy_equal"] >= 1
+    assert prof.calls["names_match_permissive"] == 1
+
+
+def test_counting_disabled():
+    prof = Profiler(count_calls=False)
+    with prof.counting():
+        matching.names_match_permissive("DURAND Marie", "DURANT Marie")
+    assert not prof.calls
+
+
+def test_nested_stages_not_in_total():
+    prof = Profiler()
+    with prof.stage("Ingestion"):
+        with prof.stage("Cosmident", within="Ingestion"):
+            pass
+    with prof.stage("Matching"):
+        pass
+    by_name = {s["etape"]: s["secondes"] for s in prof.stages}
+    assert prof.total_seconds() == by_name["Ingestion"] + by_name["Matching"]
+    assert [s.get("dans") for s in prof.stages] == ["Ingestion", None, None]